@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+'''
+Benchmarks the monitor without any hardware.
+
+The hardware and network libraries are replaced by the fakes in fakes.py and
+the monitor is built from a generated configuration with N Synthetic devices
+(plus one of each real device type unless --no-hardware is given). Every
+device count runs in its own process, so memory numbers don't carry over.
+
+For each count this reports the run_handlers cycle latency, the device poll,
+snapshot and per-handler costs and the process memory. Results are written
+as JSON; pass an earlier run with --compare to see what changed:
+
+    ./benchmark.py --output before.json
+    ./benchmark.py --compare before.json
+'''
+import argparse
+import configparser
+import contextlib
+import http.server
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import fakes
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class ThingSpeakServer(http.server.BaseHTTPRequestHandler):
+    '''
+    Accepts every bulk update, so uploads cost what a good connection would
+    '''
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(202)
+        self.send_header('Content-Length', '16')
+        self.end_headers()
+        self.wfile.write(b'{"success":true}')
+
+    def log_message(self, format, *args):
+        pass
+
+def build_config(count, workdir, thingspeak_url, hardware=True, latency=0.0, failure_rate=0.0):
+    config = configparser.ConfigParser()
+
+    synthetic = ['synthetic%d' % i for i in range(count)]
+    devices = synthetic + ['exhaust_fan']
+    if hardware:
+        devices += ['air', 'right', 'epsolar', 'weather']
+
+    config['main'] = {
+        'devices': ','.join(devices),
+        'handlers': 'json_file,thingspeak,fan_control',
+    }
+
+    # Put the sun high overhead right now so the fan controller does its full job
+    now = time.gmtime()
+    config['location'] = {
+        'latitude': '0',
+        'longitude': str(-15 * (now.tm_hour + now.tm_min / 60.0 - 12)),
+    }
+
+    for i, name in enumerate(synthetic):
+        config[name] = {
+            'type': 'Synthetic',
+            'filter': 'hampel',
+            'temperature': '82',
+            'step': '1',
+            'latency': str(latency),
+            'failure_rate': str(failure_rate),
+        }
+
+    config['exhaust_fan'] = {'type': 'Fan', 'fwd_pin': '12', 'bwd_pin': '16', 'pwm_pin': '18'}
+    if hardware:
+        config['air'] = {'type': 'AM2302', 'power_pin': '23', 'data_pin': '24', 'filter': 'hampel'}
+        # No therm_bulk_read here, so the probe is read through w1thermsensor
+        config['right'] = {'type': 'DS18B20', 'hwid': '020291772cf7', 'w1_path': workdir, 'filter': 'hampel'}
+        config['epsolar'] = {'type': 'EPSolarCharger', 'port': '/dev/null'}
+        config['weather'] = {'type': 'OpenWeatherMap', 'api_key': 'benchmark', 'city_id': '5141508'}
+
+    config['json_file'] = {'type': 'JsonFile', 'path': os.path.join(workdir, 'state.json')}
+
+    # ThingSpeak channels have 8 fields
+    config['thingspeak'] = {
+        'type': 'ThingSpeak',
+        'api_key': 'benchmark',
+        'channel_id': '1',
+        'url': thingspeak_url,
+        'queue': os.path.join(workdir, 'thingspeak.db'),
+    }
+    for i, name in enumerate(synthetic[:8]):
+        config['thingspeak']['field%d' % (i + 1)] = name + '.temperature'
+
+    config['fan_control'] = {
+        'type': 'FanController',
+        'fan': 'exhaust_fan',
+        'primary_temp_sensors': ','.join(synthetic[:4]),
+    }
+    if len(synthetic) > 4:
+        config['fan_control']['backup_temp_sensors'] = ','.join(synthetic[4:8])
+
+    return config
+
+def load_monitor():
+    '''
+    Import greenhouse-monitor.py, the dash keeps it from being imported normally
+    '''
+    spec = importlib.util.spec_from_file_location('greenhouse_monitor', os.path.join(HERE, 'greenhouse-monitor.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def memory():
+    '''
+    Resident and peak resident set size in KiB
+    '''
+    status = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM'):
+                status[key] = int(value.split()[0])
+    return status.get('VmRSS'), status.get('VmHWM')
+
+def summarize(samples):
+    '''
+    Milliseconds, medians and p95s are what get compared between runs
+    '''
+    samples = sorted(sample * 1000 for sample in samples)
+    if not samples:
+        return None
+    return {
+        'median': statistics.median(samples),
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'max': samples[-1],
+        'mean': statistics.mean(samples),
+    }
+
+def timed(timings, name, function):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.setdefault(name, []).append(time.perf_counter() - start)
+    return wrapper
+
+def run_one(count, args):
+    '''
+    Benchmark a single device count in this process
+    '''
+    fakes.install(latency=args.latency, failure_rate=args.failure_rate, seed=args.seed)
+    monitor_module = load_monitor()
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ThingSpeakServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        config = build_config(count, workdir, 'http://127.0.0.1:%d' % server.server_port,
+            hardware=args.hardware, latency=args.latency, failure_rate=args.failure_rate)
+
+        rss_before, _ = memory()
+        monitor = monitor_module.GreenhouseMonitor()
+        setup_start = time.perf_counter()
+        monitor.setup(config)
+        monitor.start_devices()
+        monitor.wait_until_started()
+        setup_time = time.perf_counter() - setup_start
+
+        for i in range(args.warmup):
+            monitor.run_handlers()
+
+        timings = {}
+        monitor.update_devices = timed(timings, 'poll', monitor.update_devices)
+        monitor.snapshots.take = timed(timings, 'snapshot', monitor.snapshots.take)
+        for handler_name in monitor.handlers:
+            handler = monitor.handlers[handler_name]
+            handler.process = timed(timings, 'handler.' + handler_name, handler.process)
+
+        cycles = []
+        for i in range(args.cycles):
+            start = time.perf_counter()
+            monitor.run_handlers()
+            cycles.append(time.perf_counter() - start)
+
+        rss_after, rss_peak = memory()
+        monitor.close()
+    server.shutdown()
+
+    result = {
+        'devices': len(monitor.devices),
+        'setup_ms': setup_time * 1000,
+        'cycle_ms': summarize(cycles),
+        'rss_kb': rss_after,
+        'rss_growth_kb': rss_after - rss_before,
+        'rss_peak_kb': rss_peak,
+    }
+    for name in sorted(timings):
+        result[name + '_ms'] = summarize(timings[name])
+    return result
+
+def run_all(args):
+    '''
+    Run every device count in a fresh process
+    '''
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'settings': {
+            'cycles': args.cycles,
+            'warmup': args.warmup,
+            'latency': args.latency,
+            'failure_rate': args.failure_rate,
+            'hardware': args.hardware,
+            'seed': args.seed,
+        },
+        'runs': {},
+    }
+
+    for count in args.devices:
+        command = [sys.executable, os.path.abspath(__file__), '--single', str(count),
+            '--cycles', str(args.cycles), '--warmup', str(args.warmup),
+            '--latency', str(args.latency), '--failure-rate', str(args.failure_rate), '--seed', str(args.seed)]
+        if not args.hardware:
+            command.append('--no-hardware')
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, cwd=HERE).stdout
+        run = json.loads(output.decode().splitlines()[-1])
+        results['runs'][str(count)] = run
+
+        cycle = run['cycle_ms']
+        print('%5d synthetic devices: cycle median %.3fms p95 %.3fms, rss %dKiB' % (count, cycle['median'], cycle['p95'], run['rss_kb']))
+
+    return results
+
+def metrics(run):
+    '''
+    Flatten a run into the numbers worth comparing
+    '''
+    values = {}
+    for key in run:
+        if isinstance(run[key], dict):
+            values[key + '.median'] = run[key]['median']
+            values[key + '.p95'] = run[key]['p95']
+        elif key.startswith('rss') or key == 'setup_ms':
+            values[key] = run[key]
+    return values
+
+def compare(baseline, results, tolerance):
+    '''
+    Print every metric next to the baseline, returns the medians and
+    memory figures that got worse by more than tolerance percent
+    '''
+    if baseline.get('settings') != results['settings']:
+        print('Warning: baseline was run with different settings', baseline.get('settings'))
+
+    regressions = []
+    for count in results['runs']:
+        if count not in baseline['runs']:
+            continue
+        print('\n%s synthetic devices' % count)
+        before = metrics(baseline['runs'][count])
+        after = metrics(results['runs'][count])
+        for name in sorted(after):
+            if name not in before or not before[name]:
+                continue
+            change = (after[name] - before[name]) / before[name] * 100
+            # Tails are too noisy to gate on, they're shown for context
+            flag = ''
+            if change > tolerance and not name.endswith('.p95'):
+                flag = '  <-- regression'
+                regressions.append((count, name, change))
+            print('  %-28s %12.3f %12.3f %+8.1f%%%s' % (name, before[name], after[name], change, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the greenhouse monitor on fake hardware')
+    parser.add_argument('--devices', default='1,10,50,100', help='comma separated Synthetic device counts (default 1,10,50,100)')
+    parser.add_argument('--cycles', type=int, default=100, help='timed run_handlers cycles per count (default 100)')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed cycles first, fills the filters (default 20)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every fake I/O call takes (default 0)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of fake I/O calls that fail (default 0)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the fake backends (default 0)')
+    parser.add_argument('--no-hardware', dest='hardware', action='store_false', help='only Synthetic devices and the fan')
+    parser.add_argument('--output', help='write the results here as JSON')
+    parser.add_argument('--compare', help='an earlier --output to compare against')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='percent slower that counts as a regression (default 10)')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        # Keep the devices' own prints out of the result line
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_one(args.single, args)
+        print(json.dumps(result))
+        return 0
+
+    args.devices = [int(count) for count in args.devices.split(',')]
+    results = run_all(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print('\n%d metric(s) regressed more than %g%%' % (len(regressions), args.tolerance))
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
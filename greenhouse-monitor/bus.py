@@ -0,0 +1,78 @@
+'''
+An in-process topic bus, what the components of greenhouse-runtime.py
+publish their readings on.
+
+A message is a dict of field -> value (the same flat fields the shared
+memory segments hold) and optionally a document, the richer structure the
+JSON file outputs are written from. Publishing swaps in the new message,
+readers never see a half written one and never copy or parse anything.
+
+Subscriptions have SharedStateReader's update() and get(), so the fan
+control readers take either. A subscription can also have a callback,
+called in the publisher's thread.
+'''
+import threading
+
+class Subscription:
+    def __init__(self, topic, callback=None):
+        self.topic = topic
+        self.callback = callback
+        self._values = {}
+        self._seen = 0
+
+    def update(self):
+        '''
+        Pick up the latest message, returns True if there's a new one
+        '''
+        sequence, values, document = self.topic.message
+        if sequence == self._seen:
+            return False
+        self._values = values
+        self._seen = sequence
+        return True
+
+    def get(self, field, default=None):
+        value = self._values.get(field)
+        return default if value is None else value
+
+class Topic:
+    def __init__(self, name):
+        self.name = name
+        # (sequence number, values, document), replaced as a whole on publish
+        self.message = (0, {}, None)
+        self.subscriptions = []
+
+class Bus:
+    def __init__(self):
+        self._topics = {}
+        self._lock = threading.Lock()
+
+    def topic(self, name):
+        topic = self._topics.get(name)
+        if topic is None:
+            with self._lock:
+                topic = self._topics.setdefault(name, Topic(name))
+        return topic
+
+    def subscribe(self, name, callback=None):
+        '''
+        callback(values, document) is called for every later message
+        '''
+        subscription = Subscription(self.topic(name), callback)
+        with self._lock:
+            subscription.topic.subscriptions = subscription.topic.subscriptions + [subscription]
+        return subscription
+
+    def publish(self, name, values, document=None):
+        '''
+        Publish values, the bus keeps a reference so don't change them
+        afterwards. Each topic should have a single publisher.
+        '''
+        topic = self.topic(name)
+        topic.message = (topic.message[0] + 1, values, document)
+        for subscription in topic.subscriptions:
+            if subscription.callback is not None:
+                try:
+                    subscription.callback(values, document)
+                except Exception as e:
+                    print('Error in ' + name + ' subscriber:', e)
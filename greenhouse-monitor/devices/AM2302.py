@@ -1,18 +1,58 @@
 import wiringpi
 import Adafruit_DHT
-import os
+import threading
 import time
 
+from metrics import SENSOR_READ_FAILURES, SENSOR_RESETS
+
 from .Sensor import Sensor
 
 class AM2302(Sensor):
+    '''
+    The DHT protocol is timing sensitive and the sensor can only be read
+    every 2 seconds, so a dedicated thread does the sampling (and any power
+    cycling) and update() just picks up the freshest good reading.
+    '''
+
+    FIELDS = ('temperature', 'humidity')
+    # The sample time of the latest reading in ms, its age follows from that
+    EXTRAS = ('timestamp',)
+
+    # The sensor can't be read more often than this
+    MIN_INTERVAL = 2
+
     def __init__(self, device_name, device_config):
         super(AM2302, self).__init__(device_type='temperature_humidity', device_name=device_name, device_config=device_config)
         self.power_pin = int(device_config['power_pin'])
         self.data_pin = int(device_config['data_pin'])
-        wiringpi.pinMode(self.power_pin, 1)
 
+        self.sample_interval = max(self.MIN_INTERVAL, float(device_config.get('sample_interval', self.MIN_INTERVAL)))
+
+        # Readings older than this are treated as missing
+        self.max_age = float(device_config.get('max_age', 60))
+
+        # Power cycle after this many failed reads in a row
+        self.reset_after = int(device_config.get('reset_after', 3))
+
+        # How long start() waits on the first reading
+        self.start_timeout = float(device_config.get('start_timeout', 5))
+
+        self._read_failures = SENSOR_READ_FAILURES.labels(device_name, 'bad_reading')
+        self._resets = SENSOR_RESETS.labels(device_name)
+
+        self._lock = threading.Lock()
+        self._reading = None
+        self._sampled = threading.Event()
+        self._closed = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name='am2302-' + device_name, daemon=True)
+
+    def start(self):
+        wiringpi.pinMode(self.power_pin, 1)
         self._enable()
+        self._sampler.start()
+
+        # Ready with a reading if one comes quickly, otherwise the sampler catches up
+        self._sampled.wait(self.start_timeout)
 
     def _reset(self):
         '''
@@ -26,29 +66,53 @@ class AM2302(Sensor):
         wiringpi.digitalWrite(self.power_pin, 1)
         time.sleep(2)
 
+    def _sample_loop(self):
+        failures = 0
+        while not self._closed.is_set():
+            started = time.monotonic()
+            humidity, tempC = Adafruit_DHT.read(Adafruit_DHT.AM2302, self.data_pin)
+
+            if humidity is not None and humidity <= 100 and tempC is not None:
+                failures = 0
+                with self._lock:
+                    self._reading = (humidity, tempC, time.time())
+                self._sampled.set()
+            else:
+                failures += 1
+                self._read_failures.inc()
+                if failures >= self.reset_after:
+                    print('Resetting AM2302Sensor')
+                    self._resets.inc()
+                    self._reset()
+                    failures = 0
+
+            # Respect the sensor's minimum interval from the start of the last read
+            self._closed.wait(max(0, self.sample_interval - (time.monotonic() - started)))
+
     def update(self):
-        humidity, tempC = self._read()
-
-        if humidity is None or humidity > 100:
-            '''
-            Power cycle and try again
-            '''
-            print('Resetting AM2302Sensor')
-            self._reset()
-            humidity, tempC = self._read()
-
-        if humidity is not None and humidity <= 100:
-            self.data['humidity'] = humidity
-            self.data['temperature'] = self.celcius_to_fahrenheit(tempC)
-            self.data['timestamp'] = int(time.time() * 1000)
-        else:
+        with self._lock:
+            reading = self._reading
+
+        if reading is None or time.time() - reading[2] > self.max_age:
             print('No temperature data from AM2302Sensor')
-            self.data['temperature'] = 0
-            self.data['humidity'] = 0
-
-    def _read(self):
-        # Go high-priority when reading this sensor to make it more reliable
-        os.nice(-20)
-        humidity, tempC = Adafruit_DHT.read_retry(Adafruit_DHT.AM2302, self.data_pin, delay_seconds=0.25)
-        os.nice(20)
-        return humidity, tempC
+            self.publish('temperature', None)
+            self.publish('humidity', None)
+            return
+
+        humidity, tempC, timestamp = reading
+        if self.reading.extra('timestamp') == int(timestamp * 1000):
+            # Nothing new from the sampler, don't feed the filters the same reading twice
+            return
+
+        # Stamped with when the sampler took them, not when they were collected
+        self.publish('humidity', humidity, timestamp)
+        self.publish('temperature', self.celcius_to_fahrenheit(tempC), timestamp)
+        self.reading.set_extra('timestamp', int(timestamp * 1000))
+
+    def close(self):
+        '''
+        Called on shutdown
+        '''
+        self._closed.set()
+        if self._sampler.is_alive():
+            self._sampler.join(timeout=5)
@@ -1,16 +1,53 @@
 from w1thermsensor import W1ThermSensor
 import w1thermsensor.errors
+
+from metrics import SENSOR_READ_FAILURES
+from w1bus import get_bus
+
 from .Sensor import Sensor
 
 class DS18B20(Sensor):
+    FIELDS = ('temperature',)
+
     def __init__(self, device_name, device_config):
         super(DS18B20, self).__init__(device_type='temperature', device_name=device_name, device_config=device_config)
         self.hwid = device_config['hwid']
-        self.__sensor = W1ThermSensor(W1ThermSensor.THERM_SENSOR_DS18B20, self.hwid)
+        self.__sensor = None
+
+        # All probes share one conversion per cycle when the kernel supports it
+        self.__bus = get_bus(device_config.get('w1_path', '/sys/bus/w1/devices'))
+
+        self._no_reading = SENSOR_READ_FAILURES.labels(device_name, 'no_reading')
+        self._not_ready = SENSOR_READ_FAILURES.labels(device_name, 'not_ready')
+
+    def start(self):
+        self._find_sensor()
+
+    def _find_sensor(self):
+        # Right after the bus powers up the probe may not be listed yet, update() tries again
+        try:
+            self.__sensor = W1ThermSensor(W1ThermSensor.THERM_SENSOR_DS18B20, self.hwid)
+        except w1thermsensor.errors.NoSensorFoundError as e:
+            print('DS18B20 (' + self.hwid + ') not found yet:', e)
 
     def update(self):
+        if self.__bus.bulk:
+            tempC = self.__bus.read(self.hwid)
+            if tempC is None:
+                self._no_reading.inc()
+            self.publish('temperature', None if tempC is None else self.celcius_to_fahrenheit(tempC))
+            return
+
+        if self.__sensor is None:
+            self._find_sensor()
+            if self.__sensor is None:
+                self._not_ready.inc()
+                self.publish('temperature', None)
+                return
+
         try:
-            self.data['temperature'] = self.__sensor.get_temperature(W1ThermSensor.DEGREES_F)
-        except w1thermsensor.errors.SensorNotReadyError as e:
+            self.publish('temperature', self.__sensor.get_temperature(W1ThermSensor.DEGREES_F))
+        except (w1thermsensor.errors.SensorNotReadyError, OSError) as e:
             print('No temperature data from DS18B20 (' + self.hwid + '):', e)
-            self.data['temperature'] = 0
+            self._not_ready.inc()
+            self.publish('temperature', None)
@@ -1,39 +1,77 @@
-from epsolar_tracer.client import EPsolarTracerClient
-from epsolar_tracer.enums.RegisterTypeEnum import RegisterTypeEnum
+import time
+
+from epsolarbroker import BrokerClient
 
 from .Sensor import Sensor
 
+# Everything we read each cycle, fetched in as few transactions as possible
+REGISTERS = [
+    'BATTERY_TEMPERATURE',
+    'BATTERY_SOC',
+    'CHARGING_EQUIPMENT_OUTPUT_POWER',
+    'TEMPERATURE_INSIDE_EQUIPMENT',
+    'CHARGING_EQUIPMENT_INPUT_POWER',
+    'DISCHARGING_EQUIPMENT_OUTPUT_POWER',
+]
+
 class EPSolarCharger(Sensor):
+    '''
+    Reads through epsolar-broker.py when `socket` is configured, otherwise
+    talks to the charge controller on `port` directly. Only the direct mode
+    needs epsolar_tracer.
+    '''
+    FIELDS = ('battery.temperature', 'battery.state_of_charge', 'battery.output_power', 'temperature', 'charging.input_power', 'discharging.output_power')
+
     def __init__(self, device_name, device_config):
         super(EPSolarCharger, self).__init__(device_type='charger', device_name=device_name, device_config=device_config)
 
-        self._client = epsolar = EPsolarTracerClient(port=device_config['port'])
+        if 'socket' in device_config:
+            self._broker = BrokerClient(device_config['socket'].strip())
+            # Broker values older than this count as missing
+            self.max_age = float(device_config.get('max_age', 30))
+        else:
+            from epsolar_tracer.client import EPsolarTracerClient
+            from epsolar_tracer.enums.RegisterTypeEnum import RegisterTypeEnum
+            from register_planner import RegisterPlanner
 
-        self.data['battery'] = {}
-        self.data['charging'] = {}
-        self.data['discharging'] = {}
+            self._broker = None
+            self._client = EPsolarTracerClient(port=device_config['port'])
+            self._register_types = [RegisterTypeEnum[name] for name in REGISTERS]
+            self._planner = RegisterPlanner(self._register_types, max_block=int(device_config.get('max_block', 32)))
 
     def update(self):
-        # Get the battery temperature
-        response = self._client.read_input(RegisterTypeEnum.BATTERY_TEMPERATURE)
-        self.data['battery']['temperature'] = self.celcius_to_fahrenheit(response.value)
+        values = self._read()
 
-        # Get the battery state of charge
-        response = self._client.read_input(RegisterTypeEnum.BATTERY_SOC)
-        self.data['battery']['state_of_charge'] = response.value
+        self.publish('battery.temperature', self._fahrenheit(values.get('BATTERY_TEMPERATURE')))
+        self.publish('battery.state_of_charge', values.get('BATTERY_SOC'))
+        self.publish('battery.output_power', values.get('CHARGING_EQUIPMENT_OUTPUT_POWER'))
+        self.publish('temperature', self._fahrenheit(values.get('TEMPERATURE_INSIDE_EQUIPMENT')))
+        self.publish('charging.input_power', values.get('CHARGING_EQUIPMENT_INPUT_POWER'))
+        self.publish('discharging.output_power', values.get('DISCHARGING_EQUIPMENT_OUTPUT_POWER'))
 
-        # Get the battery watts
-        response = self._client.read_input(RegisterTypeEnum.CHARGING_EQUIPMENT_OUTPUT_POWER)
-        self.data['battery']['output_power'] = response.value
+    def _read(self):
+        '''
+        Register name -> value for everything in REGISTERS
+        '''
+        if self._broker is None:
+            values = self._planner.read(self._client)
+            return {register_type.name: values[register_type].value for register_type in self._register_types}
 
-        # Get the equipment temperature
-        response = self._client.read_input(RegisterTypeEnum.TEMPERATURE_INSIDE_EQUIPMENT)
-        self.data['temperature'] = self.celcius_to_fahrenheit(response.value)
+        timestamp, values = self._broker.read()
+        if time.time() - timestamp > self.max_age:
+            print('No fresh data from the EPSolar broker')
+            return {}
+        return {name: values.get(name) for name in REGISTERS}
 
-        # Get the solar watts
-        response = self._client.read_input(RegisterTypeEnum.CHARGING_EQUIPMENT_INPUT_POWER)
-        self.data['charging']['input_power'] = response.value
+    def _fahrenheit(self, tempC):
+        # Registers that failed to decode come back as None
+        if tempC is None:
+            return None
+        return self.celcius_to_fahrenheit(tempC)
 
-        # Get the load watts
-        response = self._client.read_input(RegisterTypeEnum.DISCHARGING_EQUIPMENT_OUTPUT_POWER)
-        self.data['discharging']['output_power'] = response.value
\ No newline at end of file
+    def close(self):
+        '''
+        Called on shutdown
+        '''
+        if self._broker is not None:
+            self._broker.close()
@@ -1,8 +1,14 @@
 import wiringpi
 
+from fanactuator import FanActuator
+from metrics import FAN_DUTY, FAN_SPEED
+
 from .Sensor import Sensor
 
 class Fan(Sensor):
+    # What it was asked to do rather than readings
+    EXTRAS = ('speed', 'state')
+
     def __init__(self, device_name, device_config):
         super(Fan, self).__init__(device_type='exhaust', device_name=device_name, device_config=device_config)
         self.fwd_pin = int(device_config['fwd_pin'])
@@ -23,48 +29,74 @@ class Fan(Sensor):
         #freq = 19200000 / self.clock / self.range
         #print("Frequency:", freq)
 
+        self._speed_gauge = FAN_SPEED.labels(device_name)
+        self._duty_gauge = FAN_DUTY.labels(device_name)
+        self._speed_gauge.set(0)
+        self._duty_gauge.set(0)
+
         # Initialize to off
-        self.data['speed'] = 0
+        self._set('speed', 0)
         self.off()
 
+        # Does the PWM writes, ramping to each speed set_speed asks for
+        self.actuator = FanActuator.from_config(self, self.range, device_config, min_speed=10)
+
+    def start(self):
+        self.actuator.start()
+
+    def _set(self, name, value):
+        '''
+        Speed and state change outside update(), bump the generation so
+        the snapshot picks them up
+        '''
+        self.reading.set_extra(name, value)
+        self.generation += 1
+
     def fwd(self):
         wiringpi.digitalWrite(self.fwd_pin, 1)
         wiringpi.digitalWrite(self.bwd_pin, 0)
-        self.data['state'] = 'fwd'
+        self._set('state', 'fwd')
 
     def bwd(self):
         wiringpi.digitalWrite(self.bwd_pin, 1)
         wiringpi.digitalWrite(self.fwd_pin, 0)
-        self.data['state'] = 'bwd'
+        self._set('state', 'bwd')
 
     def off(self):
         wiringpi.digitalWrite(self.bwd_pin, 1)
         wiringpi.digitalWrite(self.fwd_pin, 1)
-        self.data['state'] = 'off'
+        self._set('state', 'off')
 
     def brake(self):
         wiringpi.digitalWrite(self.bwd_pin, 0)
         wiringpi.digitalWrite(self.fwd_pin, 0)
-        self.data['state'] = 'brake'
+        self._set('state', 'brake')
+
+    def write_duty(self, speed):
+        '''
+        Called from the actuator's thread
+        '''
+        duty = int(self.range * speed / 100)
+        wiringpi.pwmWrite(self.pwm_pin, duty)
+        self._speed_gauge.set(speed)
+        self._duty_gauge.set(duty)
 
     def set_speed(self, speed):
+        '''
+        The speed to ramp to, the actuator gets there on its own time
+        '''
         if speed < 10:
             speed = 0
 
-        if speed == self.data['speed']:
+        if speed == self.reading.extra('speed'):
             return
 
-        if speed == 0:
-            self.off()
-        else:
-            self.fwd()
-
-        self.data['speed'] = speed
-        duty = int(self.range * speed / 100)
-        wiringpi.pwmWrite(self.pwm_pin, duty)
+        self._set('speed', speed)
+        self.actuator.set_target(speed)
 
     def close(self):
         '''
         Called on shutdown
         '''
+        self.actuator.close()
         self.off()
@@ -1,30 +1,38 @@
 import pyowm
 import pyowm.exceptions
 
+from metrics import SENSOR_READ_FAILURES
+
 from .Sensor import Sensor
 
 class OpenWeatherMap(Sensor):
+    FIELDS = ('temperature', 'humidity', 'pressure')
+    EXTRAS = ('wind', 'sunrise', 'sunset', 'clouds', 'weather_icon_url')
+
     def __init__(self, device_name, device_config):
         super(OpenWeatherMap, self).__init__(device_type='weather', device_name=device_name, device_config=device_config)
         api_key = device_config.get('api_key').strip()
 
         self.city_id = int(device_config.get('city_id'))
         self.owm = pyowm.OWM(api_key)
+        self._errors = SENSOR_READ_FAILURES.labels(device_name, 'owm_error')
 
     def update(self):
         try:
             self.observation = self.owm.weather_at_id(self.city_id)
         except pyowm.exceptions.OWMError as e:
             print('Error updating OpenWeatherMap data:', e)
+            self._errors.inc()
+            self.invalidate()
             return
 
         weather = self.observation.get_weather()
 
-        self.data['temperature'] = weather.get_temperature('fahrenheit')['temp']
-        self.data['humidity'] = weather.get_humidity()
-        self.data['wind'] = weather.get_wind()
-        self.data['sunrise'] = weather.get_sunrise_time()
-        self.data['sunset'] = weather.get_sunset_time()
-        self.data['pressure'] = weather.get_pressure()['press']
-        self.data['clouds'] = weather.get_clouds()
-        self.data['weather_icon_url'] = weather.get_weather_icon_url()
+        self.publish('temperature', weather.get_temperature('fahrenheit')['temp'])
+        self.publish('humidity', weather.get_humidity())
+        self.reading.set_extra('wind', weather.get_wind())
+        self.reading.set_extra('sunrise', weather.get_sunrise_time())
+        self.reading.set_extra('sunset', weather.get_sunset_time())
+        self.publish('pressure', weather.get_pressure()['press'])
+        self.reading.set_extra('clouds', weather.get_clouds())
+        self.reading.set_extra('weather_icon_url', weather.get_weather_icon_url())
@@ -1,53 +1,161 @@
 import json
-import urllib.request
+import threading
+import time
+
+from flask import make_response
+
+from filters import make_filter
+from metrics import SENSOR_OUTLIERS
+from readings import Record, Schema
+
+# Seconds between the log lines summarizing a device's rejected outliers
+OUTLIER_REPORT_INTERVAL = 600
 
 class Sensor:
+    # Dotted paths of the numeric readings this device publishes
+    FIELDS = ()
+    # Anything else it reports, set with self.reading.set_extra()
+    EXTRAS = ()
+
     def __init__(self, device_name, device_type, device_config):
         self.device_type = device_type
         self.device_name = device_name
-        self.__device_path = self.device_type + '/' + self.device_name
-        self.data = {}
+        self.device_path = self.device_type + '/' + self.device_name
+
+        # The latest readings, see readings.py
+        self.schema = Schema.of(type(self))
+        self.reading = Record(self.schema)
+
+        # Seconds between updates
+        self.interval = float(device_config.get('interval', 10))
+
+        # Seconds an update may take before the poller gives up waiting on it
+        self.deadline = float(device_config.get('deadline', 5))
+
+        # Set when the last update failed or missed its deadline
+        self.stale = False
+
+        # 'starting' until start() returns, then 'ready' or 'failed' if it raised.
+        # Devices aren't polled until they're ready.
+        self.state = 'starting'
+        self.ready = threading.Event()
+
+        # Bumped after every successful update, and by devices changing outside one
+        self.generation = 0
+
+        # Encoded data from the latest snapshot, shared with every reader
+        self.body = None
+
+        # Outlier filtering for published readings, one filter per field
+        self.filter_kind = device_config.get('filter', 'none').strip()
+        self.filter_window = int(device_config.get('filter_window', 15))
+        self.filter_threshold = float(device_config.get('filter_threshold', 3))
+        self.filter_min_deviation = float(device_config.get('filter_min_deviation', 1))
+        # One per field, None where there's no filtering
+        self.filters = [make_filter(self.filter_kind, self.filter_window, self.filter_threshold, self.filter_min_deviation) for field in self.schema.fields]
+        self._outliers = [SENSOR_OUTLIERS.labels(device_name, field) for field in self.schema.fields]
+        # Rejections since the last log line, and when that was
+        self._unreported_outliers = 0
+        self._outliers_reported = None
 
     def celcius_to_fahrenheit(self, tempC):
         return tempC * 9/5.0 + 32
 
+    @property
+    def data(self):
+        '''
+        The readings as a nested dict, built on every access. Only for
+        serializing, readers should use self.reading.getter().
+        '''
+        return self.reading.to_dict()
+
+    @property
+    def valid(self):
+        '''
+        Field -> whether its latest reading was good, for published fields
+        '''
+        reading = self.reading
+        return {field: bool(reading.valid[index]) for index, field in enumerate(self.schema.fields) if reading.published >> index & 1}
+
     def fill_data(self, data):
         data[self.device_name] = self.data
 
+    def start(self):
+        '''
+        Slow hardware setup (powering up, waiting for a first reading). All
+        devices start concurrently after they're constructed, keep __init__
+        quick.
+        '''
+        pass
+
     def update(self):
         '''
         Update the sensor data
         '''
         pass
 
-    def notify(self):
+    def publish(self, field, value, timestamp=None):
+        '''
+        Store a reading of one of FIELDS, taken at timestamp (default now),
+        after passing it through the field's filter. None marks a failed
+        read. Rejected and failed readings are stored as missing and flagged
+        invalid.
+        '''
+        index = self.schema.index[field]
+        filter_ = self.filters[index]
+        if value is not None and filter_ is not None and not filter_.accept(value):
+            self._reject(index, value)
+            value = None
+
+        self.reading.set(index, value, timestamp)
+
+    def _reject(self, index, value):
+        '''
+        Count a rejected outlier. The first one is logged, after that a
+        noisy sensor gets one summary line per OUTLIER_REPORT_INTERVAL.
+        '''
+        self._outliers[index].inc()
+        now = time.monotonic()
+        if self._outliers_reported is None:
+            print('Rejected outlier from ' + self.device_name + ' ' + self.schema.fields[index] + ':', value)
+            self._outliers_reported = now
+            return
+
+        self._unreported_outliers += 1
+        if now - self._outliers_reported >= OUTLIER_REPORT_INTERVAL:
+            print('Rejected %d outliers from %s in the last %d minutes, latest %s: %s' % (self._unreported_outliers,
+                self.device_name, (now - self._outliers_reported) // 60, self.schema.fields[index], value))
+            self._unreported_outliers = 0
+            self._outliers_reported = now
+
+    def invalidate(self):
         '''
-        Push an unsolicited update to SmartThings
+        Flag every published field as invalid, keeping the last values
         '''
-        body = self.get_body()
-        headers = {
-            'Content-Type': 'application/json',
-            'Content-Length': len(body),
-            'Device': self.__device_path
-        }
-        if smartthings_notify_url:
-            req = urllib.request.Request(smartthings_notify_url, method='NOTIFY', headers=headers, data=body)
-            urllib.request.urlopen(req, timeout=15)
+        self.reading.invalidate()
 
     def get_response(self):
         '''
         Get a response for an HTTP GET or POST
         '''
         resp = make_response(self.get_body())
-        resp.headers['Device'] = self.__device_path
+        resp.headers['Content-Type'] = 'application/json'
+        resp.headers['Device'] = self.device_path
         return resp
 
     def get_body(self):
         '''
-        Get the body we send out for response/notify
+        Get the body we send out for responses and SmartThings pushes
+        '''
+        if self.body is None:
+            return self.encode()
+        return self.body
+
+    def encode(self):
+        '''
+        Serialize the current data, normally only done once per snapshot
         '''
-        body = json.dumps(self.data).encode()
-        return body
+        return self.reading.encode()
 
     def close(self):
         '''
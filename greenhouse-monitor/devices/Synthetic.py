@@ -0,0 +1,39 @@
+import random
+import time
+
+from .Sensor import Sensor
+
+class Synthetic(Sensor):
+    '''
+    A made-up temperature/humidity sensor that random walks around a
+    starting point. Used to run and benchmark the monitor without hardware,
+    each instance is seeded from its name so runs are repeatable.
+    '''
+    FIELDS = ('temperature', 'humidity')
+
+    def __init__(self, device_name, device_config):
+        super(Synthetic, self).__init__(device_type='temperature_humidity', device_name=device_name, device_config=device_config)
+        self._random = random.Random(device_config.get('seed', device_name))
+
+        # Seconds each update takes and the fraction of updates that fail
+        self.latency = float(device_config.get('latency', 0))
+        self.failure_rate = float(device_config.get('failure_rate', 0))
+
+        self._temperature = float(device_config.get('temperature', 75))
+        self._humidity = float(device_config.get('humidity', 50))
+        self._step = float(device_config.get('step', 0.2))
+
+    def update(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self._random.random() < self.failure_rate:
+            print('No data from Synthetic sensor ' + self.device_name)
+            self.publish('temperature', None)
+            self.publish('humidity', None)
+            return
+
+        self._temperature += self._random.gauss(0, self._step)
+        self._humidity = min(100, max(0, self._humidity + self._random.gauss(0, self._step)))
+        self.publish('temperature', self._temperature)
+        self.publish('humidity', self._humidity)
@@ -1,5 +1,19 @@
-from .AM2302 import AM2302
-from .DS18B20 import DS18B20
-from .EPSolarCharger import EPSolarCharger
-from .Fan import Fan
-from .OpenWeatherMap import OpenWeatherMap
\ No newline at end of file
+'''
+Device types, imported only when a configuration uses them
+'''
+from plugins import PluginRegistry
+
+registry = PluginRegistry('device', __name__, {
+    'AM2302': '.AM2302',
+    'DS18B20': '.DS18B20',
+    'EPSolarCharger': '.EPSolarCharger',
+    'Fan': '.Fan',
+    'OpenWeatherMap': '.OpenWeatherMap',
+    'Synthetic': '.Synthetic',
+}, group='greenhouse_monitor.devices')
+
+def __getattr__(name):
+    # devices.AM2302 and friends still work, they're just loaded on first use
+    if name in registry.builtin:
+        return registry.get(name)
+    raise AttributeError('module ' + __name__ + ' has no attribute ' + name)
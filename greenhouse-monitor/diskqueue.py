@@ -0,0 +1,50 @@
+import json
+import os
+import sqlite3
+import threading
+
+class DiskQueue:
+    '''
+    A bounded FIFO of JSON-serializable items kept in SQLite, so queued work
+    survives outages and restarts. Once full, the oldest items are dropped.
+    '''
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL)')
+
+    def put(self, item):
+        with self._lock:
+            cursor = self._db.execute('INSERT INTO items (body) VALUES (?)', (json.dumps(item),))
+            dropped = self._db.execute('DELETE FROM items WHERE id <= ?', (cursor.lastrowid - self.max_size,)).rowcount
+        if dropped:
+            print('Queue ' + self.path + ' is full, dropped ' + str(dropped) + ' oldest item(s)')
+
+    def peek(self, count):
+        '''
+        Get up to count of the oldest items without removing them, along with
+        the id to pass to remove() once they're handled
+        '''
+        with self._lock:
+            rows = self._db.execute('SELECT id, body FROM items ORDER BY id LIMIT ?', (count,)).fetchall()
+        if not rows:
+            return None, []
+        return rows[-1][0], [json.loads(body) for row_id, body in rows]
+
+    def remove(self, last_id):
+        '''
+        Drop every item up to and including last_id
+        '''
+        with self._lock:
+            self._db.execute('DELETE FROM items WHERE id <= ?', (last_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,166 @@
+import collections
+import math
+import threading
+import time
+
+DAY = 86400
+
+# Day tables kept, the least recently used is dropped first
+MAX_TABLES = 8
+
+def solar_elevation(timestamp, latitude, longitude):
+    '''
+    Apparent solar elevation in degrees (NOAA algorithm, refraction included)
+    '''
+    return refract(true_elevation(timestamp, latitude, longitude))
+
+def true_elevation(timestamp, latitude, longitude):
+    '''
+    Geometric solar elevation in degrees, without refraction
+    '''
+    jc = (timestamp / DAY + 2440587.5 - 2451545.0) / 36525.0
+
+    mean_long = math.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360)
+    mean_anom = math.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    eccentricity = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+
+    center = (math.sin(mean_anom) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+        + math.sin(2 * mean_anom) * (0.019993 - 0.000101 * jc)
+        + math.sin(3 * mean_anom) * 0.000289)
+    omega = math.radians(125.04 - 1934.136 * jc)
+    apparent_long = math.radians(math.degrees(mean_long) + center - 0.00569 - 0.00478 * math.sin(omega))
+
+    mean_obliquity = 23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60
+    obliquity = math.radians(mean_obliquity + 0.00256 * math.cos(omega))
+    declination = math.asin(math.sin(obliquity) * math.sin(apparent_long))
+
+    y = math.tan(obliquity / 2) ** 2
+    equation_of_time = 4 * math.degrees(y * math.sin(2 * mean_long)
+        - 2 * eccentricity * math.sin(mean_anom)
+        + 4 * eccentricity * y * math.sin(mean_anom) * math.cos(2 * mean_long)
+        - 0.5 * y * y * math.sin(4 * mean_long)
+        - 1.25 * eccentricity * eccentricity * math.sin(2 * mean_anom))
+
+    true_solar_minutes = ((timestamp % DAY) / 60 + equation_of_time + 4 * longitude) % 1440
+    hour_angle = math.radians(true_solar_minutes / 4 - 180)
+
+    lat = math.radians(latitude)
+    cos_zenith = math.sin(lat) * math.sin(declination) + math.cos(lat) * math.cos(declination) * math.cos(hour_angle)
+    return 90 - math.degrees(math.acos(max(-1.0, min(1.0, cos_zenith))))
+
+def refract(elevation):
+    '''
+    Apparent elevation for a geometric one
+    '''
+    # Atmospheric refraction, in arc seconds
+    if elevation > 85:
+        refraction = 0
+    elif elevation > 5:
+        t = math.tan(math.radians(elevation))
+        refraction = 58.1 / t - 0.07 / t ** 3 + 0.000086 / t ** 5
+    elif elevation > -0.575:
+        refraction = 1735 + elevation * (-518.2 + elevation * (103.4 + elevation * (-12.79 + elevation * 0.711)))
+    else:
+        refraction = -20.772 / math.tan(math.radians(elevation))
+
+    return elevation + refraction / 3600
+
+class Ephemeris:
+    '''
+    Solar elevation for a location from a per-day table.
+
+    The table for a (UTC) day is computed once at a fixed resolution and
+    everything else is interpolated from it, so asking for the elevation is
+    an index and a lerp rather than a full solar position calculation. The
+    table holds the geometric elevation, which is smooth enough to
+    interpolate. Refraction bends sharply around the horizon, so it is
+    applied afterwards.
+    '''
+    def __init__(self, latitude, longitude, resolution=60):
+        if resolution <= 0:
+            raise ValueError('Ephemeris resolution must be a positive number of seconds')
+        self.latitude = latitude
+        self.longitude = longitude
+        self.resolution = resolution
+        self._lock = threading.Lock()
+        self._tables = collections.OrderedDict()
+
+    @classmethod
+    def from_config(cls, config):
+        '''
+        Build from the [location] section of greenhouse-monitor.conf
+        '''
+        if 'location' not in config:
+            raise ValueError('No [location] section in the configuration')
+        location = config['location']
+        return cls(float(location['latitude']), float(location['longitude']), int(location.get('resolution', 60)))
+
+    def _table(self, day):
+        with self._lock:
+            table = self._tables.get(day)
+            if table is not None:
+                self._tables.move_to_end(day)
+                return table
+
+        start = day * DAY
+        # Covers the whole day even when resolution doesn't divide it
+        points = math.ceil(DAY / self.resolution) + 1
+        table = [true_elevation(start + i * self.resolution, self.latitude, self.longitude) for i in range(points)]
+        with self._lock:
+            self._tables[day] = table
+            while len(self._tables) > MAX_TABLES:
+                self._tables.popitem(last=False)
+        return table
+
+    def elevation(self, timestamp=None):
+        '''
+        Solar elevation in degrees at timestamp (default now)
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        day, offset = divmod(timestamp, DAY)
+        table = self._table(int(day))
+        index, fraction = divmod(offset / self.resolution, 1)
+        index = int(index)
+        return refract(table[index] + (table[index + 1] - table[index]) * fraction)
+
+    def next_crossing(self, threshold, after=None, rising=None, horizon=2):
+        '''
+        The next time after `after` (default now) the apparent elevation
+        crosses threshold degrees, only rising or setting ones if rising is
+        True or False. Looks up to `horizon` days ahead, returns None if the
+        sun doesn't cross it in that time.
+        '''
+        if after is None:
+            after = time.time()
+        day, offset = divmod(after, DAY)
+        day = int(day)
+        first = int(offset // self.resolution)
+
+        for d in range(day, day + horizon + 1):
+            table = self._table(d)
+            start = d * DAY
+            previous = refract(table[first if d == day else 0]) - threshold
+            for i in range(first if d == day else 0, len(table) - 1):
+                current = refract(table[i + 1]) - threshold
+                if (previous < 0) != (current < 0) and (rising is None or rising == (current > previous)):
+                    crossing = self._interpolate_crossing(table, i, start, threshold, previous < 0)
+                    if crossing > after:
+                        return crossing
+                previous = current
+        return None
+
+    def _interpolate_crossing(self, table, index, start, threshold, below):
+        '''
+        Bisect the geometric interpolation between table[index] and the next
+        point for where it refracts to threshold
+        '''
+        low, high = 0.0, 1.0
+        for i in range(20):
+            middle = (low + high) / 2
+            geometric = table[index] + (table[index + 1] - table[index]) * middle
+            if (refract(geometric) < threshold) == below:
+                low = middle
+            else:
+                high = middle
+        return start + (index + (low + high) / 2) * self.resolution
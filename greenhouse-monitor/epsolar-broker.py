@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import configparser
+import signal
+
+from epsolar_tracer.client import EPsolarTracerClient
+from epsolar_tracer.enums.RegisterTypeEnum import RegisterTypeEnum
+
+from epsolarbroker import Broker, DEFAULT_SOCKET
+
+config = configparser.ConfigParser()
+config.read('/etc/greenhouse-monitor.conf')
+broker_config = config['epsolar_broker'] if 'epsolar_broker' in config else {}
+
+port = broker_config.get('port', '/dev/ttyAMA0').strip()
+baudrate = int(broker_config.get('baudrate', 115200))
+# Fail a read quickly, the next poll is only a couple of seconds away
+timeout = float(broker_config.get('timeout', 0.5))
+
+if 'registers' in broker_config:
+    registers = [RegisterTypeEnum[name.strip()] for name in broker_config['registers'].split(',')]
+else:
+    # The _L/_H halves are decoded as part of their 32-bit register
+    registers = [reg for reg in RegisterTypeEnum if reg.name[-2:] not in ("_L", "_H")]
+
+def connect():
+    client = EPsolarTracerClient(port=port, baudrate=baudrate, timeout=timeout)
+    if not client.connect():
+        raise OSError('Could not open ' + port)
+    return client
+
+broker = Broker(registers, connect,
+    socket_path=broker_config.get('socket', DEFAULT_SOCKET).strip(),
+    interval=float(broker_config.get('interval', 2)),
+    max_block=int(broker_config.get('max_block', 32)))
+
+# Block the stop signals everywhere, the main thread just waits for one
+signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGINT, signal.SIGTERM])
+broker.start()
+
+try:
+    signal.sigwait([signal.SIGINT, signal.SIGTERM])
+finally:
+    broker.close()
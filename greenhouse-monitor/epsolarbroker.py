@@ -0,0 +1,238 @@
+'''
+One process owns the charge controller's serial port and everyone else asks
+it for values over a Unix socket.
+
+The broker polls a fixed set of registers at a fixed rate (so the charge
+controller sees one predictable load however many readers there are) and
+keeps the latest values encoded and ready to send. Clients get them back in
+well under a millisecond.
+
+Protocol: every message, either way, is a 4 byte little-endian length and a
+body. Requests are a single opcode byte, replies start with b'+' on success
+or b'-' followed by an error message.
+
+    b'L'  the register names, as a JSON list, in the order read returns them
+    b'R'  HEADER (sequence number, unix time of the last good poll, 0 if
+          there's never been one) then a float64 per register, NaN if missing
+'''
+import array
+import json
+import math
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+
+DEFAULT_SOCKET = '/run/greenhouse-epsolar.sock'
+
+LENGTH = struct.Struct('<I')
+HEADER = struct.Struct('<Qd')
+
+# Nothing we send comes close, anything bigger is garbage
+MAX_MESSAGE = 1 << 20
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def recv_message(sock):
+    '''
+    The next message body, None if the other end hung up
+    '''
+    length = _recv_exact(sock, LENGTH.size)
+    if length is None:
+        return None
+    length = LENGTH.unpack(length)[0]
+    if length > MAX_MESSAGE:
+        raise ValueError('Message of ' + str(length) + ' bytes is too big')
+    return _recv_exact(sock, length)
+
+def send_message(sock, body):
+    sock.sendall(LENGTH.pack(len(body)) + body)
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        broker = self.server.broker
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (OSError, ValueError):
+                return
+            if request is None:
+                return
+
+            if request == b'R':
+                reply = broker.latest
+            elif request == b'L':
+                reply = broker.layout
+            else:
+                reply = b'-Unknown request ' + request[:16]
+
+            try:
+                send_message(self.request, reply)
+            except OSError:
+                return
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class Broker:
+    '''
+    Polls the charge controller and serves the values. connect is called to
+    get a connected EPsolarTracerClient, again after every failed poll.
+    '''
+    def __init__(self, register_types, connect, socket_path=DEFAULT_SOCKET, interval=2, max_block=32, max_backoff=30):
+        self.register_types = list(register_types)
+        self.names = [register_type.name for register_type in self.register_types]
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._connect = connect
+        # Here rather than at the top, clients don't need epsolar_tracer
+        from register_planner import RegisterPlanner
+        self._planner = RegisterPlanner(self.register_types, max_block=max_block)
+        self._tracer = None
+        self._sequence = 0
+
+        # Both replies are prebuilt, serving one is just a send
+        self.layout = b'+' + json.dumps(self.names).encode()
+        self.latest = b'+' + HEADER.pack(0, 0) + array.array('d', [math.nan] * len(self.names)).tobytes()
+
+        # A socket left behind by a previous run would make bind fail
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.socket_path = socket_path
+        self._server = _Server(socket_path, _RequestHandler)
+        self._server.broker = self
+        # The protocol is read only
+        os.chmod(socket_path, 0o666)
+
+        self._closed = threading.Event()
+        self._poller = threading.Thread(target=self._poll_loop, name='epsolar-poll', daemon=True)
+        self._serving = threading.Thread(target=self._server.serve_forever, name='epsolar-serve', daemon=True)
+
+    def start(self):
+        self._poller.start()
+        self._serving.start()
+
+    def poll(self):
+        '''
+        Read every register once, returns False if the charge controller
+        didn't answer
+        '''
+        if self._tracer is None:
+            self._tracer = self._connect()
+
+        values = self._planner.read(self._tracer)
+        row = [values[register_type].value for register_type in self.register_types]
+        if all(value is None for value in row):
+            return False
+
+        self._sequence += 1
+        row = [math.nan if value is None else value for value in row]
+        self.latest = b'+' + HEADER.pack(self._sequence, time.time()) + array.array('d', row).tobytes()
+        return True
+
+    def _poll_loop(self):
+        backoff = 0
+        while not self._closed.is_set():
+            started = time.monotonic()
+            try:
+                ok = self.poll()
+                error = 'no response'
+            except Exception as e:
+                ok = False
+                error = e
+
+            if ok:
+                backoff = 0
+                delay = self.interval - (time.monotonic() - started)
+            else:
+                # Start over with a fresh connection, backing off while the controller is gone
+                print('EPSolar poll failed, reconnecting:', error)
+                self._disconnect()
+                backoff = min(self.max_backoff, backoff * 2 or self.interval)
+                delay = backoff
+
+            self._closed.wait(max(0, delay))
+
+    def _disconnect(self):
+        if self._tracer is not None:
+            try:
+                self._tracer.close()
+            except Exception:
+                pass
+            self._tracer = None
+
+    def close(self):
+        self._closed.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self._poller.join(timeout=5)
+        self._disconnect()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+class BrokerClient:
+    '''
+    Reads the broker's latest values, connecting (and reconnecting) as needed
+    '''
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=1.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.names = None
+        self._sock = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            self._sock = sock
+            self.names = json.loads(self._request(b'L').decode())
+        except Exception:
+            self.close()
+            raise
+
+    def _request(self, request):
+        send_message(self._sock, request)
+        reply = recv_message(self._sock)
+        if reply is None:
+            raise ConnectionError('EPSolar broker hung up')
+        if reply[:1] != b'+':
+            raise ValueError('EPSolar broker: ' + reply[1:].decode(errors='replace'))
+        return reply[1:]
+
+    def read(self):
+        '''
+        Returns the time of the broker's last good poll (0 if none) and a dict
+        of register name to value, None where the register is missing
+        '''
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    self._connect()
+                body = self._request(b'R')
+                break
+            except OSError:
+                # The broker may have restarted, try a fresh connection once
+                self.close()
+                if attempt:
+                    raise
+
+        sequence, timestamp = HEADER.unpack_from(body)
+        values = array.array('d')
+        values.frombytes(body[HEADER.size:])
+        return timestamp, {name: None if math.isnan(value) else value for name, value in zip(self.names, values)}
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
@@ -0,0 +1,399 @@
+'''
+Stand-ins for the hardware and network libraries so the monitor can be run,
+timed and tested off a Raspberry Pi.
+
+install() puts fake wiringpi, Adafruit_DHT, adafruit_dht, w1thermsensor,
+epsolar_tracer, board, digitalio, pulseio and pyowm modules into
+sys.modules. It has to be called before any device or handler module is
+imported. Every simulated I/O call sleeps for the backend's latency and fails
+at the backend's failure rate, both configurable per backend.
+
+PtyCharger is a charge controller at the other end of a pseudo terminal,
+for running the real epsolar_tracer/pymodbus stack (and epsolar-broker.py)
+against something that speaks Modbus RTU.
+'''
+import enum
+import os
+import random
+import select
+import struct
+import sys
+import threading
+import time
+import types
+
+BACKENDS = ('wiringpi', 'dht', 'w1', 'epsolar', 'gpio', 'owm')
+
+class FakeBackends:
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = dict.fromkeys(BACKENDS, latency)
+        self.failure_rate = dict.fromkeys(BACKENDS, failure_rate)
+        self.calls = dict.fromkeys(BACKENDS, 0)
+        self.random = random.Random(seed)
+
+    def io(self, backend):
+        '''
+        Simulate one I/O call, returns False if it should fail
+        '''
+        self.calls[backend] += 1
+        if self.latency[backend]:
+            time.sleep(self.latency[backend])
+        return self.random.random() >= self.failure_rate[backend]
+
+    def temperature(self):
+        return 20 + self.random.gauss(0, 0.5)
+
+backends = None
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+def _wiringpi():
+    def io(*args):
+        backends.io('wiringpi')
+
+    _module('wiringpi', wiringPiSetupGpio=io, pinMode=io, digitalWrite=io, pwmWrite=io,
+        pwmSetMode=io, pwmSetClock=io, pwmSetRange=io, PWM_MODE_MS=0)
+
+def _dht():
+    def read(sensor, pin):
+        if not backends.io('dht'):
+            return None, None
+        return 50 + backends.random.gauss(0, 1), backends.temperature()
+
+    def read_retry(sensor, pin, retries=15, delay_seconds=2):
+        return read(sensor, pin)
+
+    _module('Adafruit_DHT', AM2302=22, DHT22=22, read=read, read_retry=read_retry)
+
+    class DHT22:
+        def __init__(self, pin):
+            self.temperature = None
+            self.humidity = None
+
+        def measure(self):
+            if not backends.io('dht'):
+                raise RuntimeError('Checksum did not validate')
+            self.humidity, self.temperature = read(22, None)
+
+    _module('adafruit_dht', DHT22=DHT22)
+
+def _w1():
+    class SensorNotReadyError(Exception):
+        def __init__(self, sensor):
+            super().__init__('Sensor ' + sensor.id + ' is not yet ready to read temperature')
+
+    class NoSensorFoundError(Exception):
+        pass
+
+    errors = _module('w1thermsensor.errors', SensorNotReadyError=SensorNotReadyError, NoSensorFoundError=NoSensorFoundError)
+
+    class W1ThermSensor:
+        THERM_SENSOR_DS18B20 = 0x28
+        DEGREES_C = 1
+        DEGREES_F = 2
+
+        def __init__(self, sensor_type=None, sensor_id=None):
+            self.id = sensor_id
+
+        def get_temperature(self, unit=DEGREES_C):
+            if not backends.io('w1'):
+                raise SensorNotReadyError(self)
+            tempC = backends.temperature()
+            return tempC * 9 / 5.0 + 32 if unit == self.DEGREES_F else tempC
+
+    _module('w1thermsensor', W1ThermSensor=W1ThermSensor, errors=errors)
+
+def _epsolar():
+    class RegisterTypeEnum(enum.Enum):
+        CHARGING_EQUIPMENT_INPUT_POWER = 1
+        CHARGING_EQUIPMENT_INPUT_POWER_L = 2
+        CHARGING_EQUIPMENT_INPUT_POWER_H = 3
+        CHARGING_EQUIPMENT_OUTPUT_POWER = 4
+        CHARGING_EQUIPMENT_OUTPUT_POWER_L = 5
+        CHARGING_EQUIPMENT_OUTPUT_POWER_H = 6
+        DISCHARGING_EQUIPMENT_OUTPUT_POWER = 7
+        DISCHARGING_EQUIPMENT_OUTPUT_POWER_L = 8
+        DISCHARGING_EQUIPMENT_OUTPUT_POWER_H = 9
+        BATTERY_TEMPERATURE = 10
+        TEMPERATURE_INSIDE_EQUIPMENT = 11
+        BATTERY_SOC = 12
+
+    class Value:
+        def __init__(self, register, value):
+            self.register = register
+            self.value = None if value is None else value / register.times
+
+    class Register:
+        def __init__(self, name, address, times, size=1):
+            self.name = name
+            self.address = address
+            self.description = name
+            self.times = times
+            self.size = size
+
+        def unit(self):
+            return ('', '')
+
+        def is_coil(self):
+            return self.address < 0x1000
+
+        def is_discrete_input(self):
+            return 0x1000 <= self.address < 0x3000
+
+        def is_input_register(self):
+            return 0x3000 <= self.address < 0x9000
+
+        def is_holding_register(self):
+            return self.address >= 0x9000
+
+        def decode(self, response):
+            if not hasattr(response, 'getRegister'):
+                return Value(self, None)
+            raw = 0
+            for i in range(self.size):
+                raw |= response.getRegister(i) << (16 * i)
+            return Value(self, raw)
+
+    R = RegisterTypeEnum
+    registers = {
+        R.CHARGING_EQUIPMENT_INPUT_POWER: Register('Charging equipment input power', 0x3102, 100, 2),
+        R.CHARGING_EQUIPMENT_INPUT_POWER_L: Register('Charging equipment input power L', 0x3102, 100),
+        R.CHARGING_EQUIPMENT_INPUT_POWER_H: Register('Charging equipment input power H', 0x3103, 100),
+        R.CHARGING_EQUIPMENT_OUTPUT_POWER: Register('Charging equipment output power', 0x3106, 100, 2),
+        R.CHARGING_EQUIPMENT_OUTPUT_POWER_L: Register('Charging equipment output power L', 0x3106, 100),
+        R.CHARGING_EQUIPMENT_OUTPUT_POWER_H: Register('Charging equipment output power H', 0x3107, 100),
+        R.DISCHARGING_EQUIPMENT_OUTPUT_POWER: Register('Discharging equipment output power', 0x310E, 100, 2),
+        R.DISCHARGING_EQUIPMENT_OUTPUT_POWER_L: Register('Discharging equipment output power L', 0x310E, 100),
+        R.DISCHARGING_EQUIPMENT_OUTPUT_POWER_H: Register('Discharging equipment output power H', 0x310F, 100),
+        R.BATTERY_TEMPERATURE: Register('Battery Temperature', 0x3110, 100),
+        R.TEMPERATURE_INSIDE_EQUIPMENT: Register('Temperature inside equipment', 0x3111, 100),
+        R.BATTERY_SOC: Register('Battery SOC', 0x311A, 1),
+    }
+
+    class Response:
+        def __init__(self, values):
+            self.registers = values
+
+        def isError(self):
+            return False
+
+        def getRegister(self, index):
+            return self.registers[index]
+
+    class ErrorResponse:
+        # Like pymodbus' exception responses there's no getRegister
+        def isError(self):
+            return True
+
+    class ModbusClient:
+        '''
+        Answers every register with a plausible 16 bit value
+        '''
+        def read_input_registers(self, address, count, unit=1):
+            if not backends.io('epsolar'):
+                return ErrorResponse()
+            return Response([2500 + backends.random.randrange(100) for i in range(count)])
+
+        read_holding_registers = read_input_registers
+
+        def close(self):
+            pass
+
+    class EPsolarTracerClient:
+        def __init__(self, unit=1, serialclient=None, **kwargs):
+            self.unit = unit
+            self.client = serialclient or ModbusClient()
+
+        def connect(self):
+            return True
+
+        def close(self):
+            self.client.close()
+
+        def read_input(self, register_type):
+            register = registers[register_type]
+            return register.decode(self.client.read_input_registers(register.address, register.size, unit=self.unit))
+
+    enums = _module('epsolar_tracer.enums')
+    enums.RegisterTypeEnum = _module('epsolar_tracer.enums.RegisterTypeEnum', RegisterTypeEnum=RegisterTypeEnum)
+    package = _module('epsolar_tracer', enums=enums)
+    package.client = _module('epsolar_tracer.client', EPsolarTracerClient=EPsolarTracerClient)
+    package.registers = _module('epsolar_tracer.registers', registers=registers)
+
+def _gpio():
+    class Pins(types.ModuleType):
+        def __getattr__(self, name):
+            return name
+
+    sys.modules['board'] = Pins('board')
+
+    class Direction(enum.Enum):
+        INPUT = 0
+        OUTPUT = 1
+
+    class DigitalInOut:
+        def __init__(self, pin):
+            self.pin = pin
+            self.direction = Direction.INPUT
+            self._value = False
+
+        @property
+        def value(self):
+            return self._value
+
+        @value.setter
+        def value(self, value):
+            backends.io('gpio')
+            self._value = value
+
+    _module('digitalio', DigitalInOut=DigitalInOut, Direction=Direction)
+    _module('pulseio')
+
+def _owm():
+    class OWMError(Exception):
+        pass
+
+    exceptions = _module('pyowm.exceptions', OWMError=OWMError)
+
+    class Weather:
+        def __init__(self):
+            self.tempC = backends.temperature()
+
+        def get_temperature(self, unit='kelvin'):
+            if unit == 'fahrenheit':
+                return {'temp': self.tempC * 9 / 5.0 + 32}
+            if unit == 'celsius':
+                return {'temp': self.tempC}
+            return {'temp': self.tempC + 273.15}
+
+        def __getattr__(self, name):
+            # Everything else we read is informational
+            values = {
+                'get_humidity': 60,
+                'get_wind': {'speed': 2.1, 'deg': 180},
+                'get_pressure': {'press': 1013, 'sea_level': None},
+                'get_clouds': 40,
+                'get_sunrise_time': 0,
+                'get_sunset_time': 0,
+                'get_weather_icon_url': 'http://openweathermap.org/img/w/01d.png',
+            }
+            if name.startswith('get_'):
+                return lambda *args, **kwargs: values.get(name)
+            raise AttributeError(name)
+
+    class Observation:
+        def get_weather(self):
+            return Weather()
+
+    class OWM:
+        def __init__(self, api_key=None):
+            self.api_key = api_key
+
+        def weather_at_id(self, city_id):
+            if not backends.io('owm'):
+                raise OWMError('Simulated OpenWeatherMap failure')
+            return Observation()
+
+    _module('pyowm', OWM=OWM, exceptions=exceptions)
+
+def crc16(data):
+    '''
+    Modbus RTU CRC, little-endian as it goes on the wire
+    '''
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for i in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return struct.pack('<H', crc)
+
+class PtyCharger:
+    '''
+    Answers Modbus RTU input and holding register reads on a pty. Open
+    `path` as the serial port. Registers not in `registers` (address ->
+    16 bit word) read as 0. Set `online` to False to stop answering.
+    '''
+    # A sunny afternoon, raw words as the controller reports them
+    REGISTERS = {
+        0x3100: 1850, 0x3101: 250, 0x3102: 4625, 0x3103: 0,
+        0x3104: 1330, 0x3105: 340, 0x3106: 4522, 0x3107: 0,
+        0x310C: 1320, 0x310D: 120, 0x310E: 1584, 0x310F: 0,
+        0x3110: 2650, 0x3111: 3100, 0x311A: 78,
+    }
+
+    def __init__(self, registers=None, unit=1, latency=0.0, failure_rate=0.0, seed=0):
+        self.registers = dict(self.REGISTERS if registers is None else registers)
+        self.unit = unit
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.online = True
+        self.requests = 0
+        self._random = random.Random(seed)
+
+        self._master, self._slave = os.openpty()
+        self.path = os.ttyname(self._slave)
+
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name='pty-charger', daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        buffer = b''
+        while not self._closed.is_set():
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                buffer += os.read(self._master, 256)
+            except OSError:
+                continue
+
+            # Every read request is 8 bytes, skip ahead a byte at a time to resync on garbage
+            while len(buffer) >= 8:
+                frame = buffer[:8]
+                if crc16(frame[:6]) != frame[6:]:
+                    buffer = buffer[1:]
+                    continue
+                buffer = buffer[8:]
+                self._answer(frame)
+
+    def _answer(self, frame):
+        unit, function, address, count = struct.unpack('>BBHH', frame[:6])
+        self.requests += 1
+        if unit != self.unit or not self.online or self._random.random() < self.failure_rate:
+            return
+        if self.latency:
+            time.sleep(self.latency)
+
+        if function in (3, 4):
+            words = [self.registers.get(address + i, 0) & 0xFFFF for i in range(count)]
+            reply = struct.pack('>BBB', unit, function, 2 * count) + struct.pack('>%dH' % count, *words)
+        else:
+            # Illegal function
+            reply = struct.pack('>BBB', unit, function | 0x80, 1)
+        os.write(self._master, reply + crc16(reply))
+
+    def close(self):
+        self._closed.set()
+        self._thread.join(timeout=1)
+        os.close(self._master)
+        os.close(self._slave)
+
+def install(latency=0.0, failure_rate=0.0, seed=0):
+    '''
+    Install the fake libraries, returns the FakeBackends whose latency,
+    failure_rate and call counts can be changed and read per backend
+    '''
+    global backends
+    backends = FakeBackends(latency=latency, failure_rate=failure_rate, seed=seed)
+    _wiringpi()
+    _dht()
+    _w1()
+    _epsolar()
+    _gpio()
+    _owm()
+    return backends
@@ -0,0 +1,138 @@
+'''
+Drives a fan's PWM and direction pins from its own thread.
+
+Controllers only post a target speed, the actuator ramps the fan towards it
+a little at a time at a fixed rate. Sudden jumps from off to full speed
+pull a current spike from the solar system, ramping spreads that out. The
+controllers also no longer do GPIO from the scheduler thread.
+
+The driver is anything with fwd(), off() and write_duty(speed), the fans
+in devices/Fan.py and fan-controller.py.
+'''
+import threading
+import time
+
+# Updates per second while ramping
+RATE = 20
+
+# Percent per second
+SLEW_UP = 10
+SLEW_DOWN = 25
+
+# A step longer than this (the thread didn't get scheduled) still only moves
+# the fan this many seconds' worth
+MAX_STEP = 0.25
+
+class FanActuator:
+    def __init__(self, driver, pwm_range, rate=RATE, slew_up=SLEW_UP, slew_down=SLEW_DOWN, min_speed=0, clock=time):
+        '''
+        pwm_range is the driver's PWM range, writes that wouldn't change the
+        duty are skipped. Any speed above 0 runs the fan at least at
+        min_speed, below that the motor just stalls.
+        '''
+        self.driver = driver
+        self.pwm_range = pwm_range
+        self.period = 1.0 / rate
+        self.slew_up = slew_up
+        self.slew_down = slew_down
+        self.min_speed = min_speed
+        self.clock = clock
+
+        # Percent, what the controller asked for and what the fan is at
+        self.target = 0
+        self.speed = 0
+        self.duty = 0
+        self.running = False
+        # Hardware writes, for the benchmark
+        self.writes = 0
+
+        self._last = None
+        self._changed = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='fan-actuator', daemon=True)
+
+    @classmethod
+    def from_config(cls, driver, pwm_range, config, min_speed=0):
+        '''
+        Build from a device's section, with slew_up and slew_down in percent
+        per second, rate in updates per second and min_speed in percent
+        '''
+        return cls(driver, pwm_range,
+            rate=float(config.get('rate', RATE)),
+            slew_up=float(config.get('slew_up', SLEW_UP)),
+            slew_down=float(config.get('slew_down', SLEW_DOWN)),
+            min_speed=float(config.get('min_speed', min_speed)))
+
+    def start(self):
+        self._thread.start()
+
+    def set_target(self, speed):
+        '''
+        Safe to call from any thread, returns right away
+        '''
+        speed = max(0, min(100, speed))
+        if 0 < speed < self.min_speed:
+            speed = self.min_speed
+        self.target = speed
+        self._changed.set()
+
+    def _run(self):
+        while not self._closed.is_set():
+            if self.speed == self.target:
+                # Nothing to ramp, sleep until there's a new target
+                self._changed.wait()
+                self._changed.clear()
+                continue
+            self.step()
+            self._closed.wait(self.period)
+
+    def step(self):
+        '''
+        Move the fan one step towards the target
+        '''
+        now = self.clock.monotonic()
+        elapsed = self.period if self._last is None else min(MAX_STEP, now - self._last)
+        self._last = now
+
+        target = self.target
+        speed = self.speed
+        if target > speed:
+            # Start from the floor, anything less won't turn the fan
+            speed = min(target, max(speed + self.slew_up * elapsed, self.min_speed))
+        elif target < speed:
+            speed = max(target, speed - self.slew_down * elapsed)
+            if speed < self.min_speed:
+                # Only on the way to off, targets are never under the floor
+                speed = 0
+
+        self._apply(speed)
+        if speed == target:
+            # The next ramp starts fresh rather than from when this one ended
+            self._last = None
+
+    def _apply(self, speed):
+        running = speed > 0
+        if running != self.running:
+            if running:
+                self.driver.fwd()
+            else:
+                self.driver.off()
+            self.running = running
+
+        duty = int(self.pwm_range * speed / 100)
+        if duty != self.duty:
+            self.driver.write_duty(speed)
+            self.duty = duty
+            self.writes += 1
+        self.speed = speed
+
+    def close(self):
+        '''
+        Stop the thread and turn the fan off
+        '''
+        self._closed.set()
+        self._changed.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=1)
+        self.target = 0
+        self._apply(0)
@@ -0,0 +1,283 @@
+'''
+The PID fan control loop behind fan-controller.py.
+
+Everything that reads the time takes a `clock`, anything with the time
+module's time(), monotonic() and sleep(). It's the time module itself when
+running for real and a virtual clock in the simulator.
+'''
+import time
+
+from simple_pid import PID
+
+from looprunner import LoopRunner
+from shmstate import SharedStateReader
+
+# Celsius
+TARGET_TEMPERATURE = 26.6667
+
+P = 10
+I = 0.25
+D = 1.5
+
+# Seconds between PID updates
+SAMPLE_TIME = 3
+
+# Percent, the slowest the fan runs and the most it may speed up per update
+MIN_SPEED = 35
+MAX_INCREASE = 20
+
+def make_pid(clock=time):
+    pid = PID(P, I, D, setpoint=TARGET_TEMPERATURE, time_fn=clock.monotonic)
+    pid.output_limits = (-100, 0)
+    #pid.proportional_on_measurement = True
+    # The loop runs the PID every SAMPLE_TIME seconds. Left to the PID, a
+    # pass that woke a little earlier than the last one would be skipped.
+    pid.sample_time = None
+    return pid
+
+class Fan:
+    '''
+    Fan speed limiting, the actual outputs are up to subclasses. With an
+    actuator (a fanactuator.FanActuator) set_speed only posts the speed and
+    the actuator ramps the fan there, otherwise the outputs are written
+    directly.
+    '''
+    def __init__(self, epsolar_reader, actuator=None):
+        self.actuator = actuator
+        self._epsolar_reader = epsolar_reader
+        self._epsolar_reader.update()
+        self.max_speed = self._determine_max_fan_speed()
+        self.speed = 0
+        self.off()
+
+    def _determine_max_fan_speed(self):
+        """ Based on the current power state, determine the maximum speed we can set the fan to """
+
+        # Both are None while the charge controller isn't reporting, stay off then
+        input_power = self._epsolar_reader.input_power() or 0
+
+        if (self._epsolar_reader.battery_soc() or 0) >= 45:
+            # Battery is pretty good, allow the fan to go pretty high
+            if input_power > 80:
+                return 88
+            return 80
+
+        # Battery is on the low-side
+        # Restrict based on the input power
+
+        if input_power > 60:
+            return 75
+        if input_power > 50:
+            return 65
+        if input_power > 40:
+            return 60
+        if input_power > 30:
+            return 50
+        if input_power > 20:
+            return 40
+        if input_power > 10:
+            return 30
+
+        return 0
+
+    def fwd(self):
+        pass
+
+    def bwd(self):
+        pass
+
+    def off(self):
+        pass
+
+    def brake(self):
+        pass
+
+    def write_duty(self, speed):
+        '''
+        Drive the fan at speed percent
+        '''
+        pass
+
+    def clamp_speed(self, speed):
+        min_speed = MIN_SPEED
+        self.max_speed = self._determine_max_fan_speed()
+        RangeMax = self.max_speed - min_speed
+
+        if speed < 1:
+            return 0
+
+        # Speed into our range
+        speed = (speed * RangeMax) / 100
+        speed = speed + min_speed
+
+        return speed
+
+    def set_speed(self, speed):
+        speed = self.clamp_speed(speed)
+        if speed == self.speed:
+            return
+
+        if self.actuator is not None:
+            self.speed = speed
+            self.actuator.set_target(speed)
+            return
+
+        # Only allow the fan to up by this much at a time
+        speed = min(speed, self.speed + MAX_INCREASE)
+
+        if speed == 0:
+            self.off()
+        else:
+            self.fwd()
+
+        self.speed = speed
+        self.write_duty(speed)
+
+class StateReader:
+    def __init__(self, name, clock=time, source=None):
+        self._clock = clock
+        self._state = source if source is not None else SharedStateReader(name)
+
+    def update(self):
+        """ Returns True if the producer published anything new """
+        return self._state.update()
+
+    def get(self, field, default=None):
+        return self._state.get(field, default)
+
+class EpsolarReader(StateReader):
+    def __init__(self, clock=time, source=None):
+        StateReader.__init__(self, "epsolar", clock, source)
+
+    def _get_value(self, name, default=None):
+        last_update = self.get("time")
+        if not last_update:
+            return default
+
+        age = int(self._clock.time() - last_update)
+        if age > 30:
+            # Charge controller is not responding
+            return None
+        # Charge controller was updated recently enough
+
+        return self.get(name, default)
+
+    def battery_temperature(self):
+        return self._get_value("BATTERY_TEMPERATURE", None)
+
+    def input_power(self):
+        return self._get_value("CHARGING_EQUIPMENT_INPUT_POWER", 0)
+
+    def equipment_power(self):
+        return self._get_value("DISCHARGING_EQUIPMENT_OUTPUT_POWER", 0)
+
+    def battery_soc(self):
+        return self._get_value("BATTERY_SOC", 0)
+
+class WeatherReader(StateReader):
+    def __init__(self, clock=time, source=None):
+        StateReader.__init__(self, "weather", clock, source)
+
+    def temperature(self):
+        return self.get("temperature")
+
+class TempReader(StateReader):
+    def __init__(self, clock=time, source=None):
+        StateReader.__init__(self, "temp_sensors", clock, source)
+
+    def value(self, name):
+        last_update = self.get(name + ".time")
+        if not last_update:
+            return None
+
+        age = int(self._clock.time() - last_update)
+        if age > 10:
+            # Temperature sensor is not responding
+            return None
+
+        # Sensor was updated recently and seems valid
+        return self.get(name + ".temperature")
+
+class FanControlLoop:
+    def __init__(self, fan, sun, temp_reader, weather_reader, epsolar_reader, clock=time, log=print):
+        self.fan = fan
+        self.sun = sun
+        self.temp_reader = temp_reader
+        self.weather_reader = weather_reader
+        self.epsolar_reader = epsolar_reader
+        self.clock = clock
+        self.log = log
+        self.pid = make_pid(clock)
+
+        # What the last step saw, for logging and the simulator
+        self.greenhouse_temp = None
+        self.outside_temp = None
+        self.elevation = None
+
+    def get_greenhouse_temp(self):
+        """ Try hard to return some kind of useful temperature """
+
+        # First, try the 1wire temp sensor
+        greenhouse_temp = self.temp_reader.value("air")
+        if greenhouse_temp:
+            return greenhouse_temp
+
+        # Try to read it from the EPSolar battery sensor
+        greenhouse_temp = self.epsolar_reader.battery_temperature()
+        if greenhouse_temp:
+            return greenhouse_temp
+
+        # Okay, now what?
+        return None
+
+    def step(self):
+        '''
+        One pass of the loop, returns the seconds to wait before the next
+        '''
+        # Pick up whatever the monitors published since the last pass
+        self.temp_reader.update()
+        self.weather_reader.update()
+        self.epsolar_reader.update()
+
+        # Wait for a temperature to become available
+        greenhouse_temp = self.greenhouse_temp = self.get_greenhouse_temp()
+        if not greenhouse_temp:
+            # TODO: We could get stuck in here and run the fan forever
+            self.log("Greenhouse temperature unavailable")
+            return 5
+
+        # It's impossible to reach a temperature below the outside temperature
+        # If it's hotter outside than our setpoint, use that value instead
+        outside_temp = self.weather_reader.temperature()
+        if outside_temp:
+            self.pid.setpoint = max(TARGET_TEMPERATURE, outside_temp + 2)
+        else:
+            outside_temp = 0.0
+            self.pid.setpoint = TARGET_TEMPERATURE
+        self.outside_temp = outside_temp
+
+        # Calculate the fan speed
+        target_pwm = abs(self.pid(greenhouse_temp))
+
+        # Read some battery state
+        battery_soc = self.epsolar_reader.battery_soc()
+        input_power = self.epsolar_reader.input_power()
+        equipment_power = self.epsolar_reader.equipment_power()
+
+        # Check if the sun is low so we don't run the fan at night
+        elevation = self.elevation = self.sun.elevation(self.clock.time())
+        if elevation < 10.0:
+            # Sun's getting real low
+            target_pwm = 0
+
+        # Logging
+        self.log("Outside: %.2fC | Inside: %.2fC | Target: %.2fC | Fan: %s%% | FanMax: %s%% | Solar Elevation: %s%% | SOC %s%% | Input Power %sW | Equipment Power: %sW"
+            % (outside_temp, greenhouse_temp, self.pid.setpoint, self.fan.speed, self.fan.max_speed, str(elevation), battery_soc, input_power, equipment_power))
+
+        # Adjust the fan speed
+        self.fan.set_speed(target_pwm)
+
+        return SAMPLE_TIME
+
+    def run(self):
+        LoopRunner("fan-controller", SAMPLE_TIME, clock=self.clock, log=self.log).run(self.step)
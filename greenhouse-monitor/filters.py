@@ -0,0 +1,146 @@
+import array
+import bisect
+import math
+
+# Scales the MAD to a standard deviation for normally distributed noise
+MAD_SCALE = 1.4826
+
+class RunningStats:
+    '''
+    Mean and variance over the last `window` samples, updated in O(1) per
+    sample from a fixed-size ring
+    '''
+    def __init__(self, window):
+        self.window = window
+        self._ring = array.array('d', [0.0] * window)
+        self._next = 0
+        self.count = 0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def add(self, value):
+        if self.count == self.window:
+            old = self._ring[self._next]
+            self._sum -= old
+            self._sum_sq -= old * old
+        else:
+            self.count += 1
+        self._ring[self._next] = value
+        self._next = (self._next + 1) % self.window
+        self._sum += value
+        self._sum_sq += value * value
+
+    def mean(self):
+        return self._sum / self.count if self.count else None
+
+    def stdev(self):
+        if self.count < 2:
+            return None
+        mean = self._sum / self.count
+        return math.sqrt(max(0.0, self._sum_sq / self.count - mean * mean))
+
+class MeanFilter:
+    '''
+    Rejects samples more than `threshold` away from the running mean
+    '''
+    def __init__(self, window=10, threshold=5.0, min_samples=3):
+        self.stats = RunningStats(window)
+        self.threshold = threshold
+        self.min_samples = min_samples
+
+    def accept(self, value):
+        valid = self.stats.count < self.min_samples or abs(value - self.stats.mean()) <= self.threshold
+        self.stats.add(value)
+        return valid
+
+class HampelFilter:
+    '''
+    Rejects samples further than `threshold` scaled MADs from the median of
+    the last `window` samples.
+
+    The window is kept as a ring plus a sorted copy, both fixed-size arrays.
+    The median is an index into the sorted copy and the MAD is found with a
+    binary search over the deviations on either side of it, so apart from
+    the insert/remove in the sorted array nothing grows with the window.
+    Rejected samples still enter the window, so a real step change is
+    accepted once it holds for half a window.
+    '''
+    def __init__(self, window=15, threshold=3.0, min_deviation=1.0, min_samples=5):
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min(min_samples, window)
+
+        # Never reject changes smaller than this, a steady sensor has a MAD of 0
+        self.min_deviation = min_deviation
+
+        self._ring = array.array('d', [0.0] * window)
+        self._sorted = array.array('d')
+        self._next = 0
+
+    def median(self):
+        values = self._sorted
+        n = len(values)
+        if n % 2:
+            return values[n // 2]
+        return (values[n // 2 - 1] + values[n // 2]) / 2
+
+    def mad(self):
+        n = len(self._sorted)
+        median = self.median()
+        split = bisect.bisect_left(self._sorted, median)
+        if n % 2:
+            return self._kth_deviation(n // 2, median, split)
+        return (self._kth_deviation(n // 2 - 1, median, split) + self._kth_deviation(n // 2, median, split)) / 2
+
+    def _kth_deviation(self, k, median, split):
+        '''
+        The k-th smallest |x - median|. The deviations below the split and
+        the ones above it are each already sorted, so this is a k-th
+        smallest of two sorted sequences.
+        '''
+        values = self._sorted
+        below = split
+        above = len(values) - split
+
+        # i deviations come from below the split, k + 1 - i from above
+        lo = max(0, k + 1 - above)
+        hi = min(k + 1, below)
+        while lo < hi:
+            i = (lo + hi) // 2
+            j = k + 1 - i
+            if median - values[split - 1 - i] < values[split + j - 1] - median:
+                lo = i + 1
+            else:
+                hi = i
+        i = lo
+        j = k + 1 - i
+        low = median - values[split - i] if i > 0 else -math.inf
+        high = values[split + j - 1] - median if j > 0 else -math.inf
+        return max(low, high)
+
+    def accept(self, value):
+        valid = True
+        if len(self._sorted) >= self.min_samples:
+            limit = max(self.min_deviation, self.threshold * MAD_SCALE * self.mad())
+            valid = abs(value - self.median()) <= limit
+
+        if len(self._sorted) == self.window:
+            old = self._ring[self._next]
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        self._ring[self._next] = value
+        self._next = (self._next + 1) % self.window
+        bisect.insort(self._sorted, value)
+
+        return valid
+
+def make_filter(kind, window, threshold, min_deviation=1.0):
+    '''
+    Build a filter by its config name, None for 'none'
+    '''
+    if kind == 'hampel':
+        return HampelFilter(window=window, threshold=threshold, min_deviation=min_deviation)
+    if kind == 'mean':
+        return MeanFilter(window=window, threshold=threshold)
+    if kind == 'none':
+        return None
+    raise ValueError('Unknown filter ' + kind)
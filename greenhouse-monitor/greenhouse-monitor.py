@@ -1,23 +1,63 @@
 #!/usr/bin/env python3
+import concurrent.futures
 import configparser
-import urllib.request
-import json
-import logging
+import threading
+import time
 import wiringpi
-import time #TODO: Remove
 
+from datetime import datetime
+
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from flask import Flask
 from flask import make_response
-from flask import request
-from flask_restful import Api, Resource, reqparse
+from flask_restful import Api, Resource
 
-from sendmail import sendmail
+import devices
+import handlers
 
-class Subscription(Resource):
-    def get(self, name):
-        pass
+from metrics import REGISTRY, HANDLER_PROCESS_SECONDS, SCHEDULER_LAG_SECONDS, SCHEDULER_SKIPPED_RUNS
+from poller import Poller
+from snapshot import SnapshotCache
+
+class State(Resource):
+    '''
+    The latest snapshot of every device, or of a single device
+    '''
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    def get(self, name=None):
+        if name is None:
+            resp = make_response(self.monitor.snapshots.current.body)
+            resp.headers['Content-Type'] = 'application/json'
+            return resp
+
+        device = self.monitor.devices.get(name)
+        if device is None:
+            return {'message': 'Unknown device ' + name}, 404
+        return device.get_response()
+
+class Ready(Resource):
+    '''
+    Each device's startup state, 503 until they've all started
+    '''
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    def get(self):
+        states = {device_name: self.monitor.devices[device_name].state for device_name in self.monitor.devices}
+        return {'devices': states}, 200 if all(state == 'ready' for state in states.values()) else 503
+
+class Metrics(Resource):
+    '''
+    Everything in metrics.REGISTRY, in the Prometheus text format
+    '''
+    def get(self):
+        resp = make_response(REGISTRY.render())
+        resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return resp
 
 class GreenhouseMonitor():
     def __init__(self):
@@ -28,7 +68,9 @@ class GreenhouseMonitor():
         wiringpi.wiringPiSetupGpio()
 
         # Prepare scheduler
-        scheduler = BackgroundScheduler(daemon=True)
+        scheduler = self.scheduler = BackgroundScheduler(daemon=True)
+        scheduler.add_listener(self._job_submitted, EVENT_JOB_SUBMITTED)
+        scheduler.add_listener(self._job_skipped, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
         scheduler.start()
 
         # Parse configuration
@@ -36,32 +78,31 @@ class GreenhouseMonitor():
         config = configparser.ConfigParser()
         config.read(config_path)
 
-        # Prepare devices
-        self.devices = {}
-        devices = __import__('devices')
-        for device_name in config['main']['devices'].split(','):
-            device_config = config[device_name]
-            class_ = getattr(devices, config[device_name]['type'])
-            self.devices[device_name] = class_(device_name=device_name, device_config=device_config)
+        self.setup(config)
 
-        # Prepare data sinks
-        self.handlers = {}
-        handlers = __import__('handlers')
-        for handler_name in config['main']['handlers'].split(','):
-            handler_config = config[handler_name]
-            class_ = getattr(handlers, config[handler_name]['type'])
-            self.handlers[handler_name] = class_(handler_name=handler_name, handler_config=handler_config, devices=self.devices)
+        # Devices start up in the background, each is polled as soon as it's ready
+        self.start_devices()
 
-        # Run an initial update
-        self.run_handlers()
+        # Devices sharing an interval are polled together, each group on its own job
+        groups = {}
+        for device_name in self.devices:
+            groups.setdefault(self.devices[device_name].interval, []).append(device_name)
+        for interval in groups:
+            scheduler.add_job(self.poll_devices, 'interval', seconds=interval, args=[groups[interval]], id='poll-%gs' % interval, coalesce=True, max_instances=1)
 
-        # Start recurring jobs
-        scheduler.add_job(self.run_handlers, 'interval', seconds=10, coalesce=True)
+        # Handlers with their own interval run on a timer instead of on new data
+        for handler_name in self.handlers:
+            if self.handlers[handler_name].interval is not None:
+                scheduler.add_job(self.run_handler, 'interval', seconds=self.handlers[handler_name].interval, args=[handler_name], id='handler-' + handler_name, coalesce=True, max_instances=1)
 
         # Add flask endpoints
         app = Flask(__name__)
         api = Api(app)
-        api.add_resource(Subscription, "/subscribe/<string:name>")
+        api.add_resource(State, "/state", "/state/<string:name>", resource_class_kwargs={'monitor': self})
+        api.add_resource(Ready, "/ready", resource_class_kwargs={'monitor': self})
+        api.add_resource(Metrics, "/metrics")
+        for handler_name in self.handlers:
+            self.handlers[handler_name].add_resources(api)
 
         # Start up flask
         try:
@@ -70,23 +111,140 @@ class GreenhouseMonitor():
             app.run(debug=True,host='0.0.0.0', use_reloader=False)
         finally:
             print("GPIO Cleanup")
+            self.close()
 
-            for device_name in self.devices:
-                self.devices[device_name].close()
-            for handler_name in self.handlers:
-                self.handlers[handler_name].close()
+    def setup(self, config):
+        '''
+        Build the devices and handlers from a parsed configuration
+        '''
+        # Prepare devices, each type's module is only imported if something uses it
+        self.devices = {}
+        for device_name in config['main']['devices'].split(','):
+            device_config = config[device_name]
+            class_ = devices.registry.get(device_config['type'].strip())
+            self.devices[device_name] = class_(device_name=device_name, device_config=device_config)
 
-    def update_devices(self):
+        # One worker per device, a stuck device never starves the others
+        self.poller = Poller(max_workers=len(self.devices), on_late=self._late_update)
+
+        # Every device is encoded once per cycle and the bytes are shared
+        self.snapshots = SnapshotCache(self.devices)
+
+        # Prepare data sinks
+        self.handlers = {}
+        for handler_name in config['main']['handlers'].split(','):
+            handler_config = config[handler_name]
+            class_ = handlers.registry.get(handler_config['type'].strip())
+            self.handlers[handler_name] = class_(handler_name=handler_name, handler_config=handler_config, devices=self.devices, snapshots=self.snapshots)
+        self._handler_timings = {handler_name: HANDLER_PROCESS_SECONDS.labels(handler_name) for handler_name in self.handlers}
+
+        # Handlers never run concurrently with each other
+        self._handler_lock = threading.Lock()
+
+    def start_devices(self):
+        '''
+        Start every device concurrently, returns without waiting
+        '''
+        self._starter = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.devices), thread_name_prefix='start')
+        self._started = {}
+        for device_name in self.devices:
+            self._started[device_name] = self._starter.submit(self._start_device, self.devices[device_name])
+        self._starter.shutdown(wait=False)
+
+    def _start_device(self, device):
+        try:
+            device.start()
+        except Exception as e:
+            print('Error starting device ' + device.device_name + ':', e)
+            device.state = 'failed'
+            return
+        device.state = 'ready'
+        device.ready.set()
+
+        # Don't leave the handlers waiting on the device's first interval
+        self.poll_devices([device.device_name])
+
+    def wait_until_started(self, timeout=None):
+        '''
+        Wait for every device to finish starting, ready or failed
+        '''
+        concurrent.futures.wait(self._started.values(), timeout=timeout)
+
+    def close(self):
         for device_name in self.devices:
-            #start = time.time()
-            self.devices[device_name].update()
-            #end = time.time()
-            #print("Updated device " + device_name + ": " + str(end - start) + 's')
+            self.devices[device_name].close()
+        for handler_name in self.handlers:
+            self.handlers[handler_name].close()
+        self.poller.close()
+
+    def update_devices(self):
+        return self.poller.poll(self.devices)
+
+    def poll_devices(self, device_names):
+        '''
+        Update a group of devices and run the handlers that read from them
+        '''
+        updated = self.poller.poll({device_name: self.devices[device_name] for device_name in device_names})
+        if updated:
+            self._run_dependents(updated)
+
+    def _late_update(self, device_name):
+        '''
+        A device's update came in after its deadline, the handlers reading
+        it get it now rather than after the next poll
+        '''
+        self._run_dependents([device_name])
+
+    def _run_dependents(self, updated):
+        '''
+        Take a snapshot and run the handlers that read from the updated devices
+        '''
+        with self._handler_lock:
+            self.snapshots.take()
+            for handler_name in self.handlers:
+                handler = self.handlers[handler_name]
+                if handler.interval is not None:
+                    continue
+                dependencies = handler.dependencies()
+                if dependencies is None or not dependencies.isdisjoint(updated):
+                    self._process(handler_name)
+
+    def run_handler(self, handler_name):
+        with self._handler_lock:
+            self.snapshots.take()
+            self._process(handler_name)
 
     def run_handlers(self):
+        '''
+        Update every device and run every handler
+        '''
         self.update_devices()
-        for handler_name in self.handlers:
+        with self._handler_lock:
+            self.snapshots.take()
+            for handler_name in self.handlers:
+                self._process(handler_name)
+
+    def _process(self, handler_name):
+        start = time.perf_counter()
+        try:
             self.handlers[handler_name].process()
+        finally:
+            self._handler_timings[handler_name].observe(time.perf_counter() - start)
+
+    def _job_submitted(self, event):
+        scheduled = event.scheduled_run_times[-1]
+        lag = (datetime.now(scheduled.tzinfo) - scheduled).total_seconds()
+        SCHEDULER_LAG_SECONDS.labels(event.job_id).observe(max(0, lag))
+
+        # Coalescing folds every run missed while we were late into this one
+        job = self.scheduler.get_job(event.job_id)
+        interval = getattr(job.trigger, 'interval_length', None) if job is not None else None
+        if interval and lag >= interval:
+            SCHEDULER_SKIPPED_RUNS.labels(event.job_id, 'coalesced').inc(int(lag // interval))
+
+    def _job_skipped(self, event):
+        reason = 'still_running' if event.code == EVENT_JOB_MAX_INSTANCES else 'missed'
+        SCHEDULER_SKIPPED_RUNS.labels(event.job_id, reason).inc()
 
 
 
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+'''
+Runs the monitor and fan control loops listed in [runtime] in one process,
+passing readings over an in-memory bus instead of files and shared memory.
+'''
+import configparser
+
+from runtime import Runtime
+
+if __name__ == "__main__":
+    config = configparser.ConfigParser()
+    config.read('/etc/greenhouse-monitor.conf')
+
+    Runtime(config).run()
@@ -0,0 +1,175 @@
+import collections
+import json
+import threading
+
+from flask import Response, request
+from flask_restful import Resource
+
+from snapshot import delta
+
+from .Handler import Handler
+
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE = 15
+
+class StreamResource(Resource):
+    '''
+    GET /stream?device=a,b&field=temperature,humidity
+
+    Server-Sent Events with one delta per changed device per cycle, keyed by
+    dotted field path. Clients that reconnect with Last-Event-ID pick up from
+    the backlog, anyone else (or anyone too far behind) starts with a
+    snapshot event holding the current state.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+
+    def get(self):
+        devices = self._filter('device')
+        fields = self._filter('field')
+
+        last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+        try:
+            last_id = int(last_id)
+        except (TypeError, ValueError):
+            last_id = None
+
+        resp = Response(self.stream.follow(last_id, devices, fields), mimetype='text/event-stream')
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.headers['X-Accel-Buffering'] = 'no'
+        return resp
+
+    def _filter(self, name):
+        value = request.args.get(name)
+        if not value:
+            return None
+        return set(v.strip() for v in value.split(','))
+
+class EventStream(Handler):
+    def __init__(self, handler_name, handler_config, devices, snapshots=None):
+        super(EventStream, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices, snapshots=snapshots)
+
+        # Events kept for clients resuming with Last-Event-ID
+        self.backlog = collections.deque(maxlen=int(handler_config.get('backlog', 256)))
+
+        self._last = {}
+        self._last_id = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def add_resources(self, api):
+        api.add_resource(StreamResource, '/stream', resource_class_kwargs={'stream': self})
+
+    def process(self):
+        '''
+        Publish the fields that changed on each device since the last cycle
+        '''
+        events = []
+        for device_name in self.devices:
+            device = self.devices[device_name]
+            if device.stale:
+                continue
+
+            values = device.reading.flat()
+            changes = delta(self._last.get(device_name), values)
+            self._last[device_name] = values
+            if changes:
+                events.append((device_name, changes))
+
+        if not events:
+            return
+
+        with self._condition:
+            for device_name, changes in events:
+                self._last_id += 1
+                # Encoded once here, every client without a field filter sends these bytes as-is
+                data = json.dumps({'device': device_name, 'values': changes}, separators=(',', ':'))
+                encoded = ('id: %d\nevent: update\ndata: %s\n\n' % (self._last_id, data)).encode()
+                self.backlog.append((self._last_id, device_name, changes, encoded))
+            self._condition.notify_all()
+
+    def _events_after(self, last_id):
+        '''
+        Events newer than last_id, or None if some of them already fell out
+        of the backlog or last_id is from before a restart
+        '''
+        if last_id > self._last_id:
+            return None
+        if self.backlog and self.backlog[0][0] > last_id + 1:
+            return None
+        return [event for event in self.backlog if event[0] > last_id]
+
+    def follow(self, last_id, devices, fields):
+        with self._condition:
+            events = None if last_id is None else self._events_after(last_id)
+            current = self._last_id
+
+        if events is None:
+            # New or too far behind, start from the current state
+            last_id = current
+            state = json.loads(self.snapshots.current.body) if devices or fields else None
+            if state is None:
+                body = self.snapshots.current.body
+            else:
+                body = json.dumps(self._select_state(state, devices, fields), separators=(',', ':')).encode()
+            yield b'id: ' + str(current).encode() + b'\nevent: snapshot\ndata: ' + body + b'\n\n'
+            events = []
+
+        while True:
+            for event_id, device_name, changes, encoded in events:
+                last_id = event_id
+                if devices is not None and device_name not in devices:
+                    continue
+                if fields is None:
+                    yield encoded
+                    continue
+                values = {key: changes[key] for key in changes if key in fields}
+                if values:
+                    data = json.dumps({'device': device_name, 'values': values}, separators=(',', ':'))
+                    yield ('id: %d\nevent: update\ndata: %s\n\n' % (event_id, data)).encode()
+
+            with self._condition:
+                events = None if self._closed else self._events_after(last_id)
+                if events == []:
+                    self._condition.wait(KEEPALIVE)
+                    events = None if self._closed else self._events_after(last_id)
+                if self._closed:
+                    return
+
+            if events is None:
+                # Fell behind the backlog, let the client reconnect and resync
+                return
+            if not events:
+                yield b': keepalive\n\n'
+
+    def _select_state(self, state, devices, fields):
+        selected = {}
+        for device_name in state:
+            if devices is not None and device_name not in devices:
+                continue
+            if fields is None:
+                selected[device_name] = state[device_name]
+                continue
+            values = self._select_fields(state[device_name], fields, '')
+            if values:
+                selected[device_name] = values
+        return selected
+
+    def _select_fields(self, data, fields, prefix):
+        selected = {}
+        for key in data:
+            if isinstance(data[key], dict):
+                nested = self._select_fields(data[key], fields, prefix + key + '.')
+                if nested:
+                    selected[key] = nested
+            elif prefix + key in fields:
+                selected[key] = data[key]
+        return selected
+
+    def close(self):
+        '''
+        Called on shutdown
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
@@ -1,5 +1,8 @@
+import time
+
 from enum import Enum
-from astral import *
+
+from ephemeris import Ephemeris
 
 from .Handler import Handler
 
@@ -8,10 +11,13 @@ class CoolingState(Enum):
     COOLING = 2
 
 class FanController(Handler):
-    def __init__(self, handler_name, handler_config, devices):
-        super(FanController, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices)
+    def __init__(self, handler_name, handler_config, devices, snapshots=None):
+        super(FanController, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices, snapshots=snapshots)
+
+        self.sun = Ephemeris.from_config(handler_config.parser)
 
-        self.sun = Location(info=("Ithaca", "USA", 42.511680, -76.557191, "US/Eastern", 206))
+        # Anything with time(), the simulator swaps in its virtual clock
+        self.clock = time
 
         self.cooling_state = CoolingState.WAITING
 
@@ -30,32 +36,43 @@ class FanController(Handler):
 
         # Throw exception if self.primary_sensors is empty
         if not self.primary_sensors:
-            raise ValueError("No primary sensors given for FanController " + name)
+            raise ValueError("No primary sensors given for FanController " + handler_name)
+
+        self._primary = [sensor.reading.getter('temperature') for sensor in self.primary_sensors]
+        self._backup = [sensor.reading.getter('temperature') for sensor in self.backup_sensors]
+
+    def dependencies(self):
+        return set(sensor.device_name for sensor in self.primary_sensors + self.backup_sensors)
+
+    def _readings(self, getters):
+        '''
+        Temperatures from the sensors whose last reading was valid
+        '''
+        readings = []
+        for getter in getters:
+            temperature = getter()
+            if temperature is not None:
+                readings.append(temperature)
+        return readings
 
     def process(self):
         speed = 0
 
-        if self.sun.solar_elevation() < 10:
+        if self.sun.elevation(self.clock.time()) < 10:
             # Sun's getting real low...
             self.cooling_state = CoolingState.WAITING
             self.fan.set_speed(0)
             return
 
-        # Query primary sensors
-        readings = []
-        for sensor in self.primary_sensors:
-            readings.append(sensor.data['temperature'])
-        max_temp = max(readings)
+        # Query primary sensors, falling back to the backups
+        readings = self._readings(self._primary)
+        if not readings:
+            readings = self._readings(self._backup)
 
-        if not readings or not max_temp:
-            # Try backup sensors
-            for sensor in self.backup_sensors:
-                readings.append(sensor.data['temperature'])
-            max_temp = max(readings)
-
-        if not readings or not max_temp:
+        if not readings:
             print("No primary or backup temperature data, ignoring...")
             return
+        max_temp = max(readings)
 
         #print("Readings:", readings)
         #print("Max temp:", max_temp)
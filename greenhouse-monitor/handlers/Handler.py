@@ -1,24 +1,37 @@
 class Handler():
-    def __init__(self, handler_name, handler_config, devices):
+    def __init__(self, handler_name, handler_config, devices, snapshots=None):
         self.name = handler_name
         self.devices = devices
+        self.snapshots = snapshots
+
+        # Run on a fixed interval if set, otherwise whenever a dependency has new data
+        self.interval = float(handler_config['interval']) if 'interval' in handler_config else None
+
+        # Path -> getter, compiled on first use
+        self._getters = {}
+
+    def getter(self, path):
+        '''
+        A function returning the value at devicename.attribute.path, None
+        while there's no good reading. Raises KeyError for unknown paths.
+        '''
+        device_name, _, field = path.partition('.')
+        return self.devices[device_name].reading.getter(field)
 
     def get_device_data(self, path):
         '''
         Get data using devicename.attribute.path syntax
         '''
+        getter = self._getters.get(path)
+        if getter is None:
+            getter = self._getters[path] = self.getter(path)
+        return getter()
 
-        # Split the path and get the device
-        path = path.split('.')
-        device = self.devices[path.pop(0)]
-        data = device.data 
-   
-        # Recurse into the data using the path
-        for path_entry in path[:-1]:
-            data = data[path_entry]
-
-        # The last entry in the list is the actual value
-        return data[path[-1]]
+    def dependencies(self):
+        '''
+        Names of the devices this handler reads, None if it reads all of them
+        '''
+        return None
 
     def process(self):
         '''
@@ -26,6 +39,12 @@ class Handler():
         '''
         pass
 
+    def add_resources(self, api):
+        '''
+        Register any HTTP endpoints this handler serves
+        '''
+        pass
+
     def close(self):
         '''
         Called on shutdown
@@ -0,0 +1,184 @@
+import json
+import math
+import numbers
+import time
+
+from flask import Response
+from flask_restful import Resource, abort, reqparse
+
+from timeseries import TimeSeriesStore
+
+from .Handler import Handler
+
+# Default number of buckets when no step is given
+DEFAULT_POINTS = 300
+
+# Refuse queries that would produce more buckets than this
+MAX_POINTS = 10000
+
+# Rows sent per chunk of the streamed response
+CHUNK_ROWS = 100
+
+class HistoryResource(Resource):
+    '''
+    GET /history/<device>/<field>?start=&end=&step=
+
+    Returns min/max/mean/last per step-second bucket between start and end
+    (epoch seconds, defaulting to the last day). The response is streamed.
+    '''
+    def __init__(self, store):
+        self.store = store
+        self.parser = reqparse.RequestParser()
+        self.parser.add_argument('start', type=float, location='args')
+        self.parser.add_argument('end', type=float, location='args')
+        self.parser.add_argument('step', type=float, location='args')
+
+    def get(self, device, field):
+        args = self.parser.parse_args()
+        end = args['end'] if args['end'] is not None else time.time()
+        start = args['start'] if args['start'] is not None else end - 86400
+        if end <= start:
+            abort(400, message='end must be after start')
+
+        step = args['step'] or (end - start) / DEFAULT_POINTS
+        if step <= 0 or (end - start) / step > MAX_POINTS:
+            abort(400, message='step gives more than ' + str(MAX_POINTS) + ' points')
+
+        try:
+            series = self.store.series(device + '.' + field)
+        except ValueError:
+            series = None
+        if series is None:
+            abort(404, message='No history for ' + device + '.' + field)
+
+        return Response(self._stream(series, start, end, step), mimetype='application/json')
+
+    def _stream(self, series, start, end, step):
+        yield '{"start":%s,"end":%s,"step":%s,"columns":["time","min","max","mean","last","count"],"points":[' % (
+            json.dumps(start), json.dumps(end), json.dumps(step))
+
+        rows = []
+        separator = ''
+        bucket = None
+        for timestamp, value in series.range(start, end):
+            if math.isnan(value):
+                continue
+            index = int((timestamp - start) // step)
+            if index != bucket:
+                if bucket is not None:
+                    rows.append(self._row(start + bucket * step, low, high, total, last, count))
+                    if len(rows) >= CHUNK_ROWS:
+                        yield separator + ','.join(rows)
+                        separator = ','
+                        rows = []
+                bucket = index
+                low = high = total = last = value
+                count = 1
+            else:
+                if value < low:
+                    low = value
+                elif value > high:
+                    high = value
+                total += value
+                last = value
+                count += 1
+
+        if bucket is not None:
+            rows.append(self._row(start + bucket * step, low, high, total, last, count))
+        if rows:
+            yield separator + ','.join(rows)
+        yield ']}'
+
+    def _row(self, timestamp, low, high, total, last, count):
+        return '[%s,%s,%s,%s,%s,%d]' % (_number(timestamp), _number(low), _number(high), _number(total / count), _number(last), count)
+
+def _number(value):
+    '''
+    A float as JSON, infinities have no JSON form and go out as null
+    '''
+    return repr(value) if math.isfinite(value) else 'null'
+
+class History(Handler):
+    def __init__(self, handler_name, handler_config, devices, snapshots=None):
+        super(History, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices, snapshots=snapshots)
+        self.path = handler_config['path'].strip()
+
+        # Samples kept per series, 90 days of a device polled every 10 seconds
+        # (18 days at 2 seconds, like the charge controller)
+        capacity = int(handler_config.get('capacity', 777600))
+        self.store = TimeSeriesStore(self.path, capacity=capacity)
+
+        # Record only these device.field paths, or every numeric reading if unset
+        self.fields = None
+        if 'fields' in handler_config:
+            self.fields = [(path, self.getter(path)) for path in (f.strip() for f in handler_config['fields'].split(','))]
+
+        # Last generation recorded per device, so each update is stored once
+        self._generations = {}
+
+        # Samples dropped this cycle for being older than what's stored, and
+        # whether the last cycle dropped any
+        self._dropped = 0
+        self._behind = False
+
+    def add_resources(self, api):
+        # Queries get their own read-only mappings of the series files
+        api.add_resource(HistoryResource, '/history/<string:device>/<string:field>',
+            resource_class_kwargs={'store': TimeSeriesStore(self.path, readonly=True)})
+
+    def dependencies(self):
+        if self.fields is None:
+            return None
+        return set(path.split('.', 1)[0] for path, getter in self.fields)
+
+    def process(self):
+        '''
+        Append the readings from devices that updated since the last run
+        '''
+        now = time.time()
+
+        fresh = set()
+        for device_name in self.devices:
+            device = self.devices[device_name]
+            if not device.stale and device.generation != self._generations.get(device_name):
+                self._generations[device_name] = device.generation
+                fresh.add(device_name)
+
+        self._dropped = 0
+        if self.fields is not None:
+            for path, getter in self.fields:
+                if path.split('.', 1)[0] not in fresh:
+                    continue
+                # Paths into the extras can be strings or dicts, only numbers are kept
+                self._append_value(path, getter(), now)
+        else:
+            for device_name in fresh:
+                self._append(device_name, self.devices[device_name].reading, now)
+
+        if self._dropped and not self._behind:
+            print('Clock is behind the recorded history, dropping samples until it catches up')
+        self._behind = self._dropped > 0
+
+    def _append(self, device_name, reading, now):
+        '''
+        Every good reading and any numbers among the extras
+        '''
+        for index, field in enumerate(reading.schema.fields):
+            if reading.valid[index] and not self.store.append(device_name + '.' + field, now, reading.values[index]):
+                self._dropped += 1
+        for name in reading.schema.extras:
+            self._append_value(device_name + '.' + name, reading.extra(name), now)
+
+    def _append_value(self, path, value, now):
+        if isinstance(value, dict):
+            for key in value:
+                self._append_value(path + '.' + key, value[key], now)
+        elif isinstance(value, numbers.Real) and not isinstance(value, bool):
+            if not self.store.append(path, now, value):
+                self._dropped += 1
+
+    def close(self):
+        '''
+        Called on shutdown
+        '''
+        self.store.close()
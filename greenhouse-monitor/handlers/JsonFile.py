@@ -1,20 +1,34 @@
-import json
+import os
+import tempfile
 
 from .Handler import Handler
 
 class JsonFile(Handler):
-    def __init__(self, handler_name, handler_config, devices):
-        super(JsonFile, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices)
+    def __init__(self, handler_name, handler_config, devices, snapshots=None):
+        super(JsonFile, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices, snapshots=snapshots)
         self.path = handler_config['path'].strip()
         self.devices = devices
+        self._generation = None
 
     def process(self):
         '''
         Used to log JSON for the web interface
         '''
-        data = {}
-        for device_name in self.devices:
-            self.devices[device_name].fill_data(data)
+        snapshot = self.snapshots.current
+        if snapshot.generation == self._generation:
+            return
 
-        with open('/tmp/greenhouse_state.json', 'w') as outfile:
-            json.dump(data, outfile)
\ No newline at end of file
+        # Write next to the target and rename over it so readers never see a partial file
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path))
+        try:
+            with os.fdopen(fd, 'wb') as outfile:
+                outfile.write(snapshot.body)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print('Error writing ' + self.path + ':', e)
+            os.unlink(tmp_path)
+            return
+
+        self._generation = snapshot.generation
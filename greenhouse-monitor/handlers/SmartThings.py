@@ -0,0 +1,122 @@
+import collections
+import threading
+import urllib3
+
+from metrics import UPLOAD_ERRORS
+from snapshot import changed
+
+from .Handler import Handler
+
+class SmartThings(Handler):
+    '''
+    Pushes unsolicited device updates to a SmartThings hub.
+
+    Updates are queued per device path, so a device that changes again before
+    its last push went out only sends the latest state. A small pool of
+    senders works through the queue over keep-alive connections, the
+    scheduler thread never waits on the hub.
+    '''
+    def __init__(self, handler_name, handler_config, devices, snapshots=None):
+        super(SmartThings, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices, snapshots=snapshots)
+        self.notify_url = handler_config['notify_url'].strip()
+
+        # Numbers have to move by more than this before we push again
+        self.deadband = float(handler_config.get('deadband', 0))
+
+        max_in_flight = int(handler_config.get('max_in_flight', 2))
+        timeout = urllib3.Timeout(connect=5, read=float(handler_config.get('timeout', 15)))
+        self.http = urllib3.PoolManager(maxsize=max_in_flight, block=True, timeout=timeout, retries=False)
+
+        self._errors = UPLOAD_ERRORS.labels(handler_name, 'exception')
+
+        # Device -> the last values the hub got, and the last ones queued for it
+        self._sent = {}
+        self._queued = {}
+        self._pending = collections.OrderedDict()
+        self._in_flight = set()
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._senders = []
+        for i in range(max_in_flight):
+            sender = threading.Thread(target=self._send_loop, name='smartthings-' + str(i), daemon=True)
+            sender.start()
+            self._senders.append(sender)
+
+    def process(self):
+        '''
+        Queue a push for every device whose data changed
+        '''
+        for device_name in self.devices:
+            device = self.devices[device_name]
+            if device.stale:
+                continue
+
+            values = device.reading.flat()
+            if not changed(self._queued.get(device_name), values, self.deadband):
+                continue
+
+            with self._condition:
+                self._queued[device_name] = values
+                # Replaces any push for this device that hasn't gone out yet
+                self._pending[device.device_path] = (device_name, values, device.get_body())
+                self._condition.notify()
+
+    def _next(self):
+        '''
+        Take the oldest queued push for a device that isn't already being sent
+        '''
+        for device_path in self._pending:
+            if device_path not in self._in_flight:
+                return device_path, self._pending.pop(device_path)
+        return None, None
+
+    def _send_loop(self):
+        while True:
+            with self._condition:
+                device_path, push = self._next()
+                while device_path is None and not self._closed:
+                    self._condition.wait()
+                    device_path, push = self._next()
+                if self._closed:
+                    return
+                self._in_flight.add(device_path)
+            device_name, values, body = push
+
+            headers = {
+                'Content-Type': 'application/json',
+                'Device': device_path
+            }
+            failed = False
+            try:
+                f = self.http.request('NOTIFY', self.notify_url, body=body, headers=headers)
+                f.close()
+                if f.status >= 400:
+                    print('SmartThings Error: HTTP', f.status)
+                    failed = True
+            except Exception as e:
+                print('SmartThings Error:', e)
+                failed = True
+
+            with self._condition:
+                if failed:
+                    # Several senders share the counter, count under the lock
+                    self._errors.inc()
+                    if self._queued.get(device_name) is values:
+                        # Nothing newer is queued, compare the next cycle
+                        # against what the hub actually has so it's sent again
+                        self._queued[device_name] = self._sent.get(device_name)
+                else:
+                    self._sent[device_name] = values
+                self._in_flight.discard(device_path)
+                # A newer update for this device may have been held back
+                self._condition.notify()
+
+    def close(self):
+        '''
+        Called on shutdown
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self.http.clear()
@@ -0,0 +1,250 @@
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import urllib3
+
+from flask import request
+from flask_restful import Resource
+
+from snapshot import delta
+
+from .Handler import Handler
+
+class Subscriber:
+    def __init__(self, name, callback, expires, queue_size):
+        self.name = name
+        self.callback = callback
+        self.expires = expires
+
+        # Oldest deliveries are dropped if the receiver can't keep up
+        self.queue = collections.deque(maxlen=queue_size)
+        self.scheduled = False
+        self.dropped = 0
+        # (body, attempt) of a delivery waiting to be tried again
+        self.retry = None
+
+class Subscription(Resource):
+    '''
+    /subscribe/<name> where name is a device or device.field
+
+    GET lists the callbacks, POST registers callback=<url> with an optional
+    ttl in seconds (re-posting renews it), DELETE removes callback=<url>.
+    '''
+    def __init__(self, registry):
+        self.registry = registry
+
+    def _args(self):
+        return request.get_json(silent=True) or request.values
+
+    def get(self, name):
+        return [{'callback': s.callback, 'expires': s.expires} for s in self.registry.subscribers(name)]
+
+    def post(self, name):
+        args = self._args()
+        callback = args.get('callback')
+        if not callback or not callback.startswith(('http://', 'https://')):
+            return {'message': 'callback must be an http(s) URL'}, 400
+        device_name = name.split('.', 1)[0]
+        if device_name not in self.registry.devices:
+            return {'message': 'Unknown device ' + device_name}, 404
+        try:
+            ttl = float(args.get('ttl', self.registry.default_ttl))
+        except (TypeError, ValueError):
+            ttl = None
+        if ttl is None or not math.isfinite(ttl) or ttl <= 0:
+            return {'message': 'ttl must be a positive number of seconds'}, 400
+
+        subscriber = self.registry.subscribe(name, callback, ttl)
+        return {'name': name, 'callback': callback, 'expires': subscriber.expires}, 201
+
+    def delete(self, name):
+        callback = self._args().get('callback')
+        if not self.registry.unsubscribe(name, callback):
+            return {'message': 'No such subscription'}, 404
+        return '', 204
+
+class Subscriptions(Handler):
+    '''
+    Delivers changed values to registered webhook callbacks.
+
+    Each subscriber has its own bounded queue, and a fixed pool of workers
+    drains whichever queues have something in them, so a slow receiver only
+    delays itself and the update cycle never waits on delivery.
+    '''
+    def __init__(self, handler_name, handler_config, devices, snapshots=None):
+        super(Subscriptions, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices, snapshots=snapshots)
+        self.path = handler_config.get('path', '/var/lib/greenhouse-monitor/subscriptions.json').strip()
+        self.default_ttl = float(handler_config.get('default_ttl', 3600))
+        self.max_ttl = float(handler_config.get('max_ttl', 86400))
+        self.queue_size = int(handler_config.get('queue_size', 32))
+        self.retries = int(handler_config.get('retries', 3))
+
+        workers = int(handler_config.get('workers', 4))
+        timeout = urllib3.Timeout(connect=5, read=float(handler_config.get('timeout', 10)))
+        self.http = urllib3.PoolManager(maxsize=workers, timeout=timeout, retries=False)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='subscriptions')
+
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._last = {}
+        self._closed = False
+        self._load()
+
+    def add_resources(self, api):
+        api.add_resource(Subscription, '/subscribe/<string:name>', resource_class_kwargs={'registry': self})
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print('Error loading subscriptions from ' + self.path + ':', e)
+            return
+
+        now = time.time()
+        for entry in entries:
+            if entry['expires'] > now:
+                self._subscribers[(entry['name'], entry['callback'])] = Subscriber(entry['name'], entry['callback'], entry['expires'], self.queue_size)
+
+    def _save(self):
+        '''
+        Persist the registry, must be called with the lock held
+        '''
+        entries = [{'name': s.name, 'callback': s.callback, 'expires': s.expires} for s in self._subscribers.values()]
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print('Error saving subscriptions to ' + self.path + ':', e)
+
+    def subscribers(self, name):
+        with self._lock:
+            return [s for s in self._subscribers.values() if s.name == name]
+
+    def subscribe(self, name, callback, ttl):
+        expires = time.time() + min(ttl, self.max_ttl)
+        with self._lock:
+            subscriber = self._subscribers.get((name, callback))
+            if subscriber is None:
+                subscriber = Subscriber(name, callback, expires, self.queue_size)
+                self._subscribers[(name, callback)] = subscriber
+            subscriber.expires = expires
+            self._save()
+        return subscriber
+
+    def unsubscribe(self, name, callback):
+        with self._lock:
+            if self._subscribers.pop((name, callback), None) is None:
+                return False
+            self._save()
+        return True
+
+    def process(self):
+        '''
+        Queue the values that changed this cycle for every interested subscriber
+        '''
+        now = time.time()
+
+        changes = {}
+        for device_name in self.devices:
+            device = self.devices[device_name]
+            if device.stale:
+                continue
+            values = device.reading.flat()
+            device_changes = delta(self._last.get(device_name), values)
+            self._last[device_name] = values
+            if device_changes:
+                changes[device_name] = device_changes
+
+        with self._lock:
+            expired = [key for key in self._subscribers if self._subscribers[key].expires <= now]
+            for key in expired:
+                del self._subscribers[key]
+            if expired:
+                self._save()
+
+            for subscriber in self._subscribers.values():
+                device_name, _, field = subscriber.name.partition('.')
+                values = changes.get(device_name)
+                if not values:
+                    continue
+                if field:
+                    if field not in values:
+                        continue
+                    values = {field: values[field]}
+
+                if len(subscriber.queue) == subscriber.queue.maxlen:
+                    subscriber.dropped += 1
+                subscriber.queue.append({'name': subscriber.name, 'device': device_name, 'time': now, 'values': values})
+                if not subscriber.scheduled:
+                    subscriber.scheduled = True
+                    self._executor.submit(self._deliver, subscriber)
+
+    def _deliver(self, subscriber):
+        '''
+        Drain one subscriber's queue in order. A failed delivery is retried
+        from a timer after a backoff, the worker moves on to other queues in
+        the meantime. The subscriber stays scheduled until then, so nothing
+        behind it goes out of order.
+        '''
+        while True:
+            with self._lock:
+                if (subscriber.name, subscriber.callback) not in self._subscribers or (subscriber.retry is None and not subscriber.queue):
+                    subscriber.scheduled = False
+                    subscriber.retry = None
+                    return
+                if subscriber.retry is not None:
+                    body, attempt = subscriber.retry
+                    subscriber.retry = None
+                else:
+                    body, attempt = json.dumps(subscriber.queue.popleft()).encode(), 0
+
+            error = self._post(subscriber.callback, body)
+            if error is None:
+                continue
+            if attempt < self.retries:
+                with self._lock:
+                    subscriber.retry = (body, attempt + 1)
+                timer = threading.Timer(2 ** attempt, self._resume, args=(subscriber,))
+                timer.daemon = True
+                timer.start()
+                return
+            print('Giving up delivering to ' + subscriber.callback + ':', error)
+
+    def _post(self, callback, body):
+        '''
+        POST body to callback, returns the error or None if it was delivered
+        '''
+        try:
+            f = self.http.request('POST', callback, body=body, headers={'Content-Type': 'application/json'})
+            f.close()
+        except Exception as e:
+            return e
+        if f.status >= 500:
+            return 'HTTP ' + str(f.status)
+        return None
+
+    def _resume(self, subscriber):
+        with self._lock:
+            if self._closed:
+                return
+            self._executor.submit(self._deliver, subscriber)
+
+    def close(self):
+        '''
+        Called on shutdown
+        '''
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=False)
@@ -1,49 +1,115 @@
 import certifi
+import json
+import threading
+import time
 import urllib3
 
+from diskqueue import DiskQueue
+from metrics import UPLOAD_ERRORS
+
 from .Handler import Handler
 
 class ThingSpeak(Handler):
-    def __init__(self, handler_name, handler_config, devices):
-        super(ThingSpeak, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices)
-        self.baseURL = 'https://api.thingspeak.com/update?api_key=%s' % handler_config['api_key'] 
+    '''
+    Queues a sample per cycle and uploads them in the background through the
+    bulk update API, so slow or failing uploads never hold up the scheduler
+    and samples taken during an outage are sent once it's over.
+    '''
+    def __init__(self, handler_name, handler_config, devices, snapshots=None):
+        super(ThingSpeak, self).__init__(handler_name=handler_name, handler_config=handler_config, devices=devices, snapshots=snapshots)
+        self.api_key = handler_config['api_key'].strip()
+        self.url = '%s/channels/%s/bulk_update.json' % (handler_config.get('url', 'https://api.thingspeak.com').rstrip('/'), handler_config['channel_id'].strip())
         self.fields = []
         self.http = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
 
+        # ThingSpeak accepts one bulk update per 15 seconds on a free channel
+        self.rate_limit = float(handler_config.get('rate_limit', 15))
+        self.max_backoff = float(handler_config.get('max_backoff', 600))
+        self.batch_size = int(handler_config.get('batch_size', 960))
+        self.timeout = urllib3.Timeout(connect=5, read=float(handler_config.get('timeout', 15)))
+
+        # A day of 10 second samples by default
+        self.queue = DiskQueue(handler_config.get('queue', '/var/lib/greenhouse-monitor/thingspeak.db').strip(), int(handler_config.get('max_queue', 8640)))
+
+        self._dependencies = set()
         for option in handler_config:
             if option.startswith('field'):
-                path = handler_config[option].split('.')
-                device = devices[path.pop(0)]
-                self.fields += [[ option, path, device.data ]]
-                
+                path = handler_config[option].strip()
+                self.fields += [[ option, self.getter(path) ]]
+                self._dependencies.add(path.split('.', 1)[0])
+
+        self._errors = {reason: UPLOAD_ERRORS.labels(handler_name, reason) for reason in ('exception', 'rejected', 'rate_limited', 'server_error')}
+
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._sender = threading.Thread(target=self._send_loop, name='thingspeak', daemon=True)
+        self._sender.start()
+
+    def dependencies(self):
+        return self._dependencies
 
     def process(self):
         '''
-        Used to log the data to thingspeak
+        Queue the current values for upload
         '''
+        sample = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
 
-        request = ''
- 
-        # Build our request
-        for field in self.fields:
-            request += '&' + field[0] + '='
+        for field, getter in self.fields:
+            value = getter()
+            # No good reading, ThingSpeak leaves the field empty
+            if value is not None:
+                sample[field] = value
 
-            # Recurse into the options 
-            path = field[1]
-            data = field[2] 
-            for path_entry in path[:-1]:
-                data = data[path_entry]
+        self.queue.put(sample)
+        self._wakeup.set()
 
-            # The last entry in the list is the actual value
-            request += str(data[path[-1]]) 
+    def _send_loop(self):
+        backoff = 0
+        while not self._closed.is_set():
+            self._wakeup.clear()
+            last_id, samples = self.queue.peek(self.batch_size)
+            if not samples:
+                self._wakeup.wait()
+                continue
 
-        url = self.baseURL + request
+            if self._send(samples):
+                self.queue.remove(last_id)
+                backoff = 0
+                delay = self.rate_limit
+            else:
+                # ThingSpeak gives a lot of 500 errors, keep the samples and try again later
+                backoff = min(self.max_backoff, backoff * 2 or self.rate_limit)
+                delay = backoff
 
+            self._closed.wait(delay)
+
+    def _send(self, samples):
+        body = json.dumps({'write_api_key': self.api_key, 'updates': samples}).encode()
         try:
-            f = self.http.request('GET', url)
+            f = self.http.request('POST', self.url, body=body, headers={'Content-Type': 'application/json'}, timeout=self.timeout, retries=False)
             f.close()
         except Exception as e:
             print('ThingSpeak Error:', e)
-            # For some reason the data was not accepted
-            # ThingSpeek gives a lot of 500 errors 
-            pass        
+            self._errors['exception'].inc()
+            return False
+
+        if f.status in (200, 202):
+            return True
+        if f.status != 429 and f.status < 500:
+            # Retrying won't help, don't let a bad batch block the queue
+            print('ThingSpeak rejected ' + str(len(samples)) + ' sample(s) with HTTP ' + str(f.status) + ', dropping them')
+            self._errors['rejected'].inc()
+            return True
+
+        print('ThingSpeak Error: HTTP ' + str(f.status))
+        self._errors['rate_limited' if f.status == 429 else 'server_error'].inc()
+        return False
+
+    def close(self):
+        '''
+        Called on shutdown, anything still queued is sent on the next start
+        '''
+        self._closed.set()
+        self._wakeup.set()
+        self._sender.join(timeout=self.timeout.read_timeout + 5)
+        self.queue.close()
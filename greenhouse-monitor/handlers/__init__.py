@@ -1,3 +1,20 @@
-from .FanController import FanController
-from .JsonFile import JsonFile
-from .ThingSpeak import ThingSpeak
+'''
+Handler types, imported only when a configuration uses them
+'''
+from plugins import PluginRegistry
+
+registry = PluginRegistry('handler', __name__, {
+    'EventStream': '.EventStream',
+    'FanController': '.FanController',
+    'History': '.History',
+    'JsonFile': '.JsonFile',
+    'SmartThings': '.SmartThings',
+    'Subscriptions': '.Subscriptions',
+    'ThingSpeak': '.ThingSpeak',
+}, group='greenhouse_monitor.handlers')
+
+def __getattr__(name):
+    # handlers.JsonFile and friends still work, they're just loaded on first use
+    if name in registry.builtin:
+        return registry.get(name)
+    raise AttributeError('module ' + __name__ + ' has no attribute ' + name)
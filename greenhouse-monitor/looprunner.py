@@ -0,0 +1,133 @@
+'''
+Fixed rate loops for the standalone monitors and the fan controller.
+
+Ticks are scheduled against absolute deadlines on the monotonic clock, so
+the time a pass takes doesn't push the next one back and wall clock (NTP)
+jumps don't stretch or squash the loop. A pass that runs past the next
+deadline is an overrun. By default the ticks it covered are skipped rather
+than run back to back to catch up.
+
+Every loop keeps statistics on how late it woke up (jitter), overruns,
+skipped ticks and how much of the time it spent working (duty cycle), and
+prints them every `report_every` seconds. An overloaded Pi shows up there
+instead of silently slowing the loop down.
+'''
+import math
+import threading
+import time
+
+class LoopStats:
+    def __init__(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+        self.busy = 0.0
+        self.elapsed = 0.0
+
+    def jitter_mean(self):
+        return self.jitter_sum / self.ticks if self.ticks else 0.0
+
+    def duty_cycle(self):
+        return self.busy / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return '%d ticks, %d overruns, %d skipped, jitter mean %.1fms max %.1fms, duty cycle %.1f%%' % (
+            self.ticks, self.overruns, self.skipped, self.jitter_mean() * 1000, self.jitter_max * 1000, self.duty_cycle() * 100)
+
+class LoopRunner:
+    def __init__(self, name, interval, skip_missed=True, report_every=600, clock=time, log=print):
+        '''
+        clock is anything with the time module's monotonic() and sleep(), the
+        simulator passes its virtual clock. report_every=None turns the
+        periodic report off.
+        '''
+        self.name = name
+        self.interval = interval
+        self.skip_missed = skip_missed
+        self.report_every = report_every
+        self.clock = clock
+        self.log = log
+
+        # Since the last report, and since the loop started
+        self.stats = LoopStats()
+        self.total = LoopStats()
+
+        self.deadline = None
+        self._finished = None
+        self._report_at = None
+        self._stopped = threading.Event()
+
+    def tick(self, step):
+        '''
+        Wait for the next deadline and run step once. step may return the
+        seconds until the following tick, None keeps the regular interval.
+        '''
+        now = self.clock.monotonic()
+        if self.deadline is None:
+            self.deadline = now
+            if self.report_every:
+                self._report_at = now + self.report_every
+        elif now < self.deadline:
+            self._sleep(self.deadline - now)
+            if self._stopped.is_set():
+                return
+            now = self.clock.monotonic()
+
+        deadline = self.deadline
+        jitter = now - deadline
+        wait = step()
+        finished = self.clock.monotonic()
+
+        interval = self.interval if wait is None else wait
+        self.deadline = deadline + interval
+        skipped = 0
+        overrun = finished > self.deadline
+        if overrun and self.skip_missed and interval > 0:
+            # Line up with the first deadline still ahead of us
+            skipped = math.ceil((finished - self.deadline) / interval)
+            self.deadline += skipped * interval
+
+        # Wall time since the previous pass ended, sleeping included
+        elapsed = finished - (now if self._finished is None else self._finished)
+        self._finished = finished
+
+        for stats in (self.stats, self.total):
+            stats.ticks += 1
+            stats.overruns += overrun
+            stats.skipped += skipped
+            stats.jitter_sum += jitter
+            stats.jitter_max = max(stats.jitter_max, jitter)
+            stats.busy += finished - now
+            stats.elapsed += elapsed
+
+        if overrun:
+            self.log('%s: pass took %.3fs, %.3fs over its %gs interval%s' % (
+                self.name, finished - now, finished - deadline - interval, interval,
+                ', skipping %d tick(s)' % skipped if skipped else ''))
+
+        if self._report_at is not None and finished >= self._report_at:
+            self.log(self.name + ': ' + str(self.stats))
+            self.stats = LoopStats()
+            self._report_at = finished + self.report_every
+
+    def _sleep(self, seconds):
+        if self.clock is time:
+            # stop() cuts it short
+            self._stopped.wait(seconds)
+        else:
+            self.clock.sleep(seconds)
+
+    def run(self, step):
+        '''
+        Run step every interval until stop() is called
+        '''
+        while not self._stopped.is_set():
+            self.tick(step)
+
+    def stop(self):
+        '''
+        Safe from any thread, a pass that's running still finishes
+        '''
+        self._stopped.set()
@@ -0,0 +1,150 @@
+'''
+Counters, gauges and histograms exposed at /metrics in the Prometheus text
+format.
+
+Recording is meant to stay on permanently, so the sample path is a bisect
+and a couple of increments on preallocated storage, without locks. Callers
+look up their labelled series once (at setup) and keep it. Every series has
+a single writer in practice (a device's update, the handler lock, a sender
+thread), so plain increments don't lose counts. Scrapes read the values
+as they are, a scrape racing a write can be off by that one sample.
+'''
+import array
+import bisect
+import math
+import threading
+
+# Seconds, from a fast 1-Wire read to a DHT retry or a slow HTTP call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+class CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+class GaugeValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = math.nan
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+class HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bucket plus +Inf, cumulated when scraped
+        self.counts = array.array('Q', [0] * (len(bounds) + 1))
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        total = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            total += count
+            yield name + '_bucket', labels + (('le', _format(float(bound))),), total
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, total
+
+class Metric:
+    def __init__(self, kind, name, help, labelnames, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        '''
+        The series for these label values, created on first use. Look it up
+        once and keep it rather than calling this per sample.
+        '''
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(self.name + ' takes labels ' + ', '.join(self.labelnames))
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def render(self, lines):
+        lines.append('# HELP %s %s' % (self.name, self.help.replace('\\', '\\\\').replace('\n', '\\n')))
+        lines.append('# TYPE %s %s' % (self.name, self.kind))
+        for values in sorted(self._children):
+            labels = tuple(zip(self.labelnames, values))
+            for name, sample_labels, value in self._children[values].samples(self.name, labels):
+                if sample_labels:
+                    name += '{' + ','.join('%s="%s"' % (key, _escape(label)) for key, label in sample_labels) + '}'
+                lines.append(name + ' ' + _format(value))
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Metric('counter', name, help, labelnames, CounterValue))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Metric('gauge', name, help, labelnames, GaugeValue))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        bounds = tuple(float(bound) for bound in sorted(buckets))
+        return self._add(Metric('histogram', name, help, labelnames, lambda: HistogramValue(bounds)))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        '''
+        Everything in the Prometheus text exposition format
+        '''
+        lines = []
+        for metric in self._metrics:
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+DEVICE_UPDATE_SECONDS = REGISTRY.histogram('greenhouse_device_update_seconds', 'Time spent in each device update()', ['device'])
+DEVICE_UPDATE_FAILURES = REGISTRY.counter('greenhouse_device_update_failures_total', 'Device updates that raised or missed their deadline', ['device', 'reason'])
+HANDLER_PROCESS_SECONDS = REGISTRY.histogram('greenhouse_handler_process_seconds', 'Time spent in each handler process()', ['handler'])
+SCHEDULER_LAG_SECONDS = REGISTRY.histogram('greenhouse_scheduler_lag_seconds', 'How late scheduled jobs were submitted', ['job'])
+SCHEDULER_SKIPPED_RUNS = REGISTRY.counter('greenhouse_scheduler_skipped_runs_total', 'Scheduled runs that were skipped or coalesced into a later one', ['job', 'reason'])
+SENSOR_READ_FAILURES = REGISTRY.counter('greenhouse_sensor_read_failures_total', 'Failed reads from sensors and services', ['device', 'reason'])
+SENSOR_OUTLIERS = REGISTRY.counter('greenhouse_sensor_outliers_total', 'Readings rejected by the outlier filters', ['device', 'field'])
+SENSOR_RESETS = REGISTRY.counter('greenhouse_sensor_resets_total', 'Sensors power cycled after repeated failures', ['device'])
+UPLOAD_ERRORS = REGISTRY.counter('greenhouse_upload_errors_total', 'Failed uploads from handlers', ['handler', 'reason'])
+FAN_SPEED = REGISTRY.gauge('greenhouse_fan_speed_percent', 'Current fan speed', ['device'])
+FAN_DUTY = REGISTRY.gauge('greenhouse_fan_duty', 'PWM duty currently written to the fan', ['device'])
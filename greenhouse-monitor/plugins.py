@@ -0,0 +1,98 @@
+'''
+Maps the `type =` of a device or handler section to its class, importing
+the module behind it only when a configuration asks for it. A node then
+only pays for the drivers and client libraries it actually uses.
+
+Types are looked up in order:
+  - the built in types, by name
+  - classes added with register()
+  - setuptools entry points in the registry's group, so another package can
+    ship its own types:
+
+        entry_points={'greenhouse_monitor.devices': ['MySensor = mypackage.sensor:MySensor']}
+
+  - a 'module:Class' path given directly as the type
+'''
+import importlib
+
+def _entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return {}
+
+    found = entry_points()
+    if hasattr(found, 'select'):
+        found = found.select(group=group)
+    else:
+        found = found.get(group, [])
+    return {entry_point.name: entry_point for entry_point in found}
+
+def _load(path):
+    module_name, _, attribute = path.partition(':')
+    return getattr(importlib.import_module(module_name), attribute)
+
+class PluginRegistry:
+    def __init__(self, kind, package, builtin, group):
+        '''
+        kind names the plugins in errors, builtin maps type names to module
+        names relative to package, group is the entry point group
+        '''
+        self.kind = kind
+        self.package = package
+        self.builtin = dict(builtin)
+        self.group = group
+        self._registered = {}
+        self._entry_points = None
+        self._classes = {}
+
+    def register(self, type_name, target):
+        '''
+        Add a type, target is the class or a 'module:Class' path
+        '''
+        self._registered[type_name] = target
+        self._classes.pop(type_name, None)
+
+    def names(self):
+        if self._entry_points is None:
+            self._entry_points = _entry_points(self.group)
+        return sorted(set(self.builtin) | set(self._registered) | set(self._entry_points))
+
+    def get(self, type_name):
+        '''
+        The class for a configured type, imported on first use
+        '''
+        class_ = self._classes.get(type_name)
+        if class_ is not None:
+            return class_
+
+        try:
+            class_ = self._resolve(type_name)
+        except ImportError as e:
+            raise ImportError('Could not load ' + self.kind + ' type ' + type_name + ': ' + str(e)) from e
+
+        self._classes[type_name] = class_
+        return class_
+
+    def _resolve(self, type_name):
+        if type_name in self.builtin:
+            module = importlib.import_module(self.builtin[type_name], self.package)
+            return getattr(module, type_name)
+
+        if type_name in self._registered:
+            target = self._registered[type_name]
+            return _load(target) if isinstance(target, str) else target
+
+        # Only scan the installed packages for types we don't know
+        if self._entry_points is None:
+            self._entry_points = _entry_points(self.group)
+        if type_name in self._entry_points:
+            return self._entry_points[type_name].load()
+
+        if ':' in type_name:
+            try:
+                return _load(type_name)
+            except AttributeError:
+                pass
+
+        raise ValueError('Unknown ' + self.kind + ' type ' + type_name + ', expected one of ' + ', '.join(self.names()) + ' or module:Class')
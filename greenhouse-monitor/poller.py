@@ -0,0 +1,113 @@
+import concurrent.futures
+import threading
+import time
+
+from metrics import DEVICE_UPDATE_FAILURES, DEVICE_UPDATE_SECONDS
+
+class Poller:
+    '''
+    Updates devices concurrently, each against its own deadline.
+
+    A device that misses its deadline is left to finish in the background and
+    is marked stale. It keeps the data from its last good update and is not
+    polled again until the stuck update returns. If that late update
+    succeeds it counts like one on time, and on_late(device_name) is called
+    from the thread that ran it. Devices that haven't finished starting are
+    skipped, and so is a device another poll is already updating.
+    '''
+    def __init__(self, max_workers=None, on_late=None):
+        self.on_late = on_late
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='poller')
+        self._lock = threading.Lock()
+        # Device name -> future of the update in progress
+        self._running = {}
+        # Devices whose running update missed its deadline
+        self._stuck = set()
+        self._timings = {}
+
+    def poll(self, devices):
+        '''
+        Update every device in parallel, returns the names of the devices
+        that finished in time
+        '''
+        start = time.monotonic()
+
+        futures = {}
+        with self._lock:
+            for device_name, device in devices.items():
+                if not device.ready.is_set():
+                    continue
+                future = self._running.get(device_name)
+                if future is not None and not future.done():
+                    if device_name in self._stuck:
+                        # Still stuck in an earlier update, don't pile more work on it
+                        device.stale = True
+                    continue
+                self._stuck.discard(device_name)
+                futures[device_name] = self._running[device_name] = self._executor.submit(self._update, device_name, device)
+
+        # Wait on the tightest deadlines first, the rest keep running meanwhile
+        updated = []
+        for device_name in sorted(futures, key=lambda name: devices[name].deadline):
+            device = devices[device_name]
+            future = futures[device_name]
+            timeout = max(0, start + device.deadline - time.monotonic())
+            try:
+                future.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                print('Device ' + device_name + ' missed its ' + str(device.deadline) + 's deadline')
+                device.stale = True
+                with self._lock:
+                    self._stuck.add(device_name)
+                DEVICE_UPDATE_FAILURES.labels(device_name, 'timeout').inc()
+                future.add_done_callback(lambda future, device_name=device_name, device=device: self._finish_late(device_name, device, future))
+                continue
+            except Exception as e:
+                print('Error updating device ' + device_name + ':', e)
+                device.stale = True
+                DEVICE_UPDATE_FAILURES.labels(device_name, 'error').inc()
+                continue
+
+            device.stale = False
+            device.generation += 1
+            updated.append(device_name)
+
+        return updated
+
+    def _finish_late(self, device_name, device, future):
+        '''
+        A stuck update finally returned
+        '''
+        with self._lock:
+            if self._running.get(device_name) is not future:
+                return
+            self._stuck.discard(device_name)
+
+        error = future.exception()
+        if error is not None:
+            print('Error updating device ' + device_name + ':', error)
+            DEVICE_UPDATE_FAILURES.labels(device_name, 'error').inc()
+            return
+
+        print('Device ' + device_name + ' finished its late update')
+        device.stale = False
+        device.generation += 1
+        if self.on_late is not None:
+            self.on_late(device_name)
+
+    def _update(self, device_name, device):
+        timing = self._timings.get(device_name)
+        if timing is None:
+            timing = self._timings[device_name] = DEVICE_UPDATE_SECONDS.labels(device_name)
+
+        start = time.perf_counter()
+        try:
+            device.update()
+        finally:
+            timing.observe(time.perf_counter() - start)
+
+    def close(self):
+        '''
+        Called on shutdown
+        '''
+        self._executor.shutdown(wait=False)
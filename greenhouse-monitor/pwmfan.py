@@ -0,0 +1,50 @@
+'''
+fan-controller.py's fan, driven through the GPIO pins
+'''
+import digitalio
+import wiringpi
+
+from fanactuator import FanActuator
+from fancontrol import Fan, MAX_INCREASE, MIN_SPEED, SAMPLE_TIME
+
+class PWMFan(Fan):
+    def __init__(self, fwd_pin, bwd_pin, pwm_pin, epsolar_reader):
+        self._fwd = digitalio.DigitalInOut(fwd_pin)
+        self._fwd.direction = digitalio.Direction.OUTPUT
+
+        self._bwd = digitalio.DigitalInOut(bwd_pin)
+        self._bwd.direction = digitalio.Direction.OUTPUT
+
+        self._pwm_pin = pwm_pin
+        wiringpi.pinMode(pwm_pin, 2)
+        wiringpi.pwmSetMode(wiringpi.PWM_MODE_MS)
+
+        self.range = 240 # 20Khz
+        self.clock = 4 # Must be at least 2
+        wiringpi.pwmSetClock(self.clock)
+        wiringpi.pwmSetRange(self.range)
+
+        # Same average climb as MAX_INCREASE per PID update, just smooth
+        actuator = FanActuator(self, self.range, slew_up=MAX_INCREASE / SAMPLE_TIME, min_speed=MIN_SPEED)
+
+        Fan.__init__(self, epsolar_reader, actuator)
+
+    def fwd(self):
+        self._fwd.value = True
+        self._bwd.value = False
+
+    def bwd(self):
+        self._fwd.value = False
+        self._bwd.value = True
+
+    def off(self):
+        self._fwd.value = True
+        self._bwd.value = True
+
+    def brake(self):
+        self._fwd.value = False
+        self._bwd.value = False
+
+    def write_duty(self, speed):
+        duty = int(self.range * speed / 100)
+        wiringpi.pwmWrite(self._pwm_pin, duty)
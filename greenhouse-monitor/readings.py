@@ -0,0 +1,198 @@
+'''
+Fixed layout reading records for devices.
+
+A device class declares its FIELDS, the numeric readings it publishes as
+dotted paths ('battery.state_of_charge'), and its EXTRAS, anything else it
+reports (the fan's state, the wind from OpenWeatherMap). The layout is
+worked out once per class. Each device keeps one Record. Every field has a
+value, the time it was published and whether it was good, in flat arrays
+indexed by position. Updating a reading allocates nothing.
+
+Readers resolve a path to a getter once and call it every cycle. The
+nested dict the API and the pushes send is only built when a device is
+serialized.
+'''
+import array
+import json
+import math
+import time
+
+from snapshot import flatten
+
+# Extras that have never been set are left out of the dict view
+_MISSING = object()
+
+def _finite(value):
+    '''
+    A stored value for the views, failed reads (NaN) and infinities have
+    no JSON form and read as None
+    '''
+    return value if math.isfinite(value) else None
+
+class Schema:
+    # Device class -> its schema
+    _classes = {}
+
+    def __init__(self, fields, extras=()):
+        self.fields = tuple(fields)
+        self.extras = tuple(extras)
+        self.index = {field: i for i, field in enumerate(self.fields)}
+        self.extra_index = {extra: i for i, extra in enumerate(self.extras)}
+        if len(self.index) != len(self.fields) or set(self.index) & set(self.extra_index):
+            raise ValueError('Duplicate field in ' + ', '.join(self.fields + self.extras))
+
+        # (parent keys, key, index) of every field, for building the nested view
+        self.layout = []
+        for index, field in enumerate(self.fields):
+            path = tuple(field.split('.'))
+            self.layout.append((path[:-1], path[-1], index))
+
+    @classmethod
+    def of(cls, device_class):
+        '''
+        The schema of a device class, from its FIELDS and EXTRAS
+        '''
+        schema = cls._classes.get(device_class)
+        if schema is None:
+            schema = cls._classes[device_class] = cls(device_class.FIELDS, device_class.EXTRAS)
+        return schema
+
+class Record:
+    __slots__ = ('schema', 'values', 'times', 'valid', 'published', 'extras')
+
+    def __init__(self, schema):
+        count = len(schema.fields)
+        self.schema = schema
+        self.values = array.array('d', [math.nan] * count)
+        # Unix time each field was last published, 0 if never
+        self.times = array.array('d', [0.0] * count)
+        # Whether each field's latest reading was good
+        self.valid = bytearray(count)
+        # Fields published at least once, the rest stay out of the dict view
+        self.published = 0
+        self.extras = [_MISSING] * len(schema.extras)
+
+    def set(self, index, value, timestamp=None):
+        '''
+        Store a reading by field position, None marks a failed read
+        '''
+        if value is None:
+            self.values[index] = math.nan
+            self.valid[index] = 0
+        else:
+            self.values[index] = value
+            self.valid[index] = 1
+        self.times[index] = time.time() if timestamp is None else timestamp
+        self.published |= 1 << index
+
+    def invalidate(self):
+        '''
+        Flag every field as invalid, keeping the last values
+        '''
+        for index in range(len(self.valid)):
+            self.valid[index] = 0
+
+    def all_valid(self):
+        published = self.published
+        return all(self.valid[index] for index in range(len(self.valid)) if published >> index & 1)
+
+    def get(self, field):
+        '''
+        A field's latest good value, None if it failed or hasn't been read
+        '''
+        index = self.schema.index[field]
+        return self.values[index] if self.valid[index] else None
+
+    def time(self, field):
+        '''
+        When field was last published, 0 if never
+        '''
+        return self.times[self.schema.index[field]]
+
+    def set_extra(self, name, value):
+        self.extras[self.schema.extra_index[name]] = value
+
+    def extra(self, name, default=None):
+        value = self.extras[self.schema.extra_index[name]]
+        return default if value is _MISSING else value
+
+    def getter(self, path):
+        '''
+        A function returning the value at path (a field, an extra or a key
+        inside an extra) from this record, resolved once up front. Fields
+        read as None unless their latest reading was good, paths that don't
+        exist yet inside an extra as None. Raises KeyError for paths the
+        schema doesn't have.
+        '''
+        schema = self.schema
+        index = schema.index.get(path)
+        if index is not None:
+            values = self.values
+            valid = self.valid
+            return lambda: values[index] if valid[index] else None
+
+        extras = self.extras
+        name, _, rest = path.partition('.')
+        if name not in schema.extra_index:
+            raise KeyError(path)
+        index = schema.extra_index[name]
+        keys = rest.split('.') if rest else []
+
+        def get():
+            value = extras[index]
+            if value is _MISSING:
+                return None
+            for key in keys:
+                if not isinstance(value, dict) or key not in value:
+                    return None
+                value = value[key]
+            return value
+        return get
+
+    def to_dict(self):
+        '''
+        The nested dict view, as sent by the API and the pushes
+        '''
+        data = {}
+        published = self.published
+        values = self.values
+        for parents, key, index in self.schema.layout:
+            if not published >> index & 1:
+                continue
+            parent = data
+            for name in parents:
+                parent = parent.setdefault(name, {})
+            # Invalidated fields keep their last value
+            parent[key] = _finite(values[index])
+        if published:
+            data['valid'] = self.all_valid()
+        for name, value in zip(self.schema.extras, self.extras):
+            if value is not _MISSING:
+                data[name] = value
+        return data
+
+    def encode(self):
+        '''
+        The dict view as JSON bytes
+        '''
+        return json.dumps(self.to_dict()).encode()
+
+    def flat(self):
+        '''
+        The dict view flattened to dotted paths, without building it
+        '''
+        values = {}
+        published = self.published
+        for index, field in enumerate(self.schema.fields):
+            if published >> index & 1:
+                values[field] = _finite(self.values[index])
+        if published:
+            values['valid'] = self.all_valid()
+        for name, value in zip(self.schema.extras, self.extras):
+            if value is _MISSING:
+                continue
+            if isinstance(value, dict):
+                values.update(flatten(value, name + '.'))
+            else:
+                values[name] = value
+        return values
@@ -0,0 +1,86 @@
+from epsolar_tracer.registers import registers
+
+class _BlockView:
+    '''
+    A window into a multi-register read that looks like a single register
+    response to Register.decode
+    '''
+    def __init__(self, values, offset):
+        self._values = values
+        self._offset = offset
+
+    def getRegister(self, index):
+        return self._values[self._offset + index]
+
+class RegisterPlanner:
+    '''
+    Groups the requested registers into contiguous address ranges so each
+    range costs one Modbus transaction instead of one per register.
+
+    Overlapping registers (a 32-bit value and its _L/_H halves) share the
+    same words and are decoded from the same block.
+    '''
+    def __init__(self, register_types, max_block=32, max_gap=0):
+        self.register_types = list(register_types)
+        self.blocks = []
+        self.singles = []
+
+        # Coils and discrete inputs don't come back as words, read those one by one
+        words = []
+        for register_type in self.register_types:
+            register = registers.get(register_type)
+            if register is None:
+                raise ValueError('Unknown register ' + register_type.name)
+            if register.is_input_register() or register.is_holding_register():
+                words.append((register.address, register_type, register))
+            else:
+                self.singles.append(register_type)
+        words.sort(key=lambda entry: entry[0])
+
+        block = None
+        for address, register_type, register in words:
+            end = address + register.size
+            same_table = block is not None and block['holding'] == register.is_holding_register()
+            if same_table and address <= block['end'] + max_gap and end - block['start'] <= max_block:
+                block['end'] = max(block['end'], end)
+            else:
+                block = {
+                    'holding': register.is_holding_register(),
+                    'start': address,
+                    'end': end,
+                    'members': []
+                }
+                self.blocks.append(block)
+            block['members'].append((register_type, register))
+
+    def read(self, tracer):
+        '''
+        Read every planned register through an EPsolarTracerClient, returns
+        a dict of register type to decoded Value
+        '''
+        client = tracer.client
+        results = {}
+
+        for block in self.blocks:
+            count = block['end'] - block['start']
+            if block['holding']:
+                response = client.read_holding_registers(block['start'], count, unit=tracer.unit)
+            else:
+                response = client.read_input_registers(block['start'], count, unit=tracer.unit)
+
+            values = getattr(response, 'registers', None)
+            if response is None or response.isError() or values is None or len(values) < count:
+                # The controller refused the range, fall back to reading each register
+                print('Block read of ' + hex(block['start']) + '+' + str(count) + ' failed, reading registers one by one')
+                for register_type, register in block['members']:
+                    results[register_type] = tracer.read_input(register_type)
+                continue
+
+            for register_type, register in block['members']:
+                view = _BlockView(values, register.address - block['start'])
+                results[register_type] = register.decode(view)
+
+        for register_type in self.singles:
+            results[register_type] = tracer.read_input(register_type)
+
+        return results
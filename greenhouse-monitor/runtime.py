@@ -0,0 +1,401 @@
+'''
+The monitor and fan control loops as components of one process.
+
+Each component is a step() run every `interval` seconds by its own
+LoopRunner thread. Monitors publish their readings on a topic of the
+in-memory bus (the same names as their shared memory segments), and the
+fan controller subscribes to the topics it needs. Topics that no component
+in this process publishes are read from shared memory instead, so a
+component can also run on its own. That's what temp-monitor.py,
+epsolar-monitor.py, weather-monitor.py and fan-controller.py do.
+
+greenhouse-runtime.py runs the components listed in [runtime] together.
+Each component has a section of its own. `output` names a JSON file to
+write every reading to, and `shared_memory` publishes a segment for other
+processes. Both are off in the runtime and on for the standalone scripts,
+which keep writing the files they always did.
+
+A component whose step raises stops the whole process with status 1 rather
+than leaving the others running without it, systemd restarts the service.
+'''
+import fcntl
+import json
+import signal
+import threading
+import time
+import traceback
+
+from bus import Bus
+from looprunner import LoopRunner
+from shmstate import SharedStateWriter
+
+class JsonFileOutput:
+    '''
+    Writes each message's document to a file, under an exclusive lock
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, values, document):
+        with open(self.path, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(json.dumps(values if document is None else document))
+
+class SharedStateOutput:
+    '''
+    Writes each message's values to a shared memory segment, laid out from
+    the fields of the first message and again whenever they change
+    '''
+    def __init__(self, name):
+        self.name = name
+        self._state = None
+
+    def __call__(self, values, document):
+        fields = list(values)
+        if self._state is None or self._state.fields != fields:
+            self.close()
+            self._state = SharedStateWriter(self.name, fields)
+        self._state.write(values)
+
+    def close(self):
+        if self._state is not None:
+            self._state.close()
+            self._state = None
+
+class Component:
+    # Bus topic and shared memory segment the readings are published on
+    topic = None
+    # Default seconds between steps
+    interval = 10
+    # JSON file the standalone script writes
+    output = None
+
+    def __init__(self, name, config, runtime):
+        self.name = name
+        self.config = config
+        self.runtime = runtime
+        self.interval = float(config.get('interval', self.interval))
+
+    def publish(self, values, document=None):
+        self.runtime.bus.publish(self.topic, values, document)
+
+    def step(self):
+        '''
+        One pass, may return the seconds until the next instead of interval
+        '''
+        pass
+
+    def close(self):
+        pass
+
+class TempMonitor(Component):
+    topic = 'temp_sensors'
+    interval = 2
+    output = '/tmp/temp_sensors.json'
+
+    # What temp-monitor.py has always read
+    SENSORS = {
+        'soil': 'DS18B20 02099177e85e D17',
+        'air': 'DS18B20 020291772cf7 D17',
+    }
+
+    def __init__(self, name, config, runtime):
+        super(TempMonitor, self).__init__(name, config, runtime)
+
+        import board
+        import digitalio
+        import tempsensors
+
+        # Power on the 1-Wire bus
+        self._w1 = digitalio.DigitalInOut(getattr(board, config.get('w1_power_pin', 'D17').strip()))
+        self._w1.direction = digitalio.Direction.OUTPUT
+        self._w1.value = True
+
+        if 'sensors' in config:
+            names = [sensor.strip() for sensor in config['sensors'].split(',')]
+            specs = {sensor: config[sensor] for sensor in names}
+        else:
+            names = list(self.SENSORS)
+            specs = self.SENSORS
+        self.sensors = [tempsensors.from_spec(sensor, specs[sensor]) for sensor in names]
+
+    def step(self):
+        values = {}
+        document = {}
+        for sensor in self.sensors:
+            sensor.update()
+            values[sensor.name + '.temperature'] = sensor.temp
+            values[sensor.name + '.humidity'] = sensor.humidity
+            values[sensor.name + '.time'] = sensor.time
+            document[sensor.name] = {
+                'temperature': sensor.temp,
+                'humidity': sensor.humidity,
+                'time': int(sensor.time),
+                'model': sensor.model,
+            }
+        self.publish(values, document)
+
+class EpsolarMonitor(Component):
+    topic = 'epsolar'
+    interval = 2
+    output = '/tmp/epsolar.json'
+
+    def __init__(self, name, config, runtime):
+        super(EpsolarMonitor, self).__init__(name, config, runtime)
+
+        from epsolar_tracer.enums.RegisterTypeEnum import RegisterTypeEnum
+        from epsolar_tracer.registers import registers
+        from epsolarbroker import BrokerClient, DEFAULT_SOCKET
+
+        # The broker's socket unless configured otherwise
+        broker_config = runtime.config['epsolar_broker'] if 'epsolar_broker' in runtime.config else {}
+        socket_path = config.get('socket', broker_config.get('socket', DEFAULT_SOCKET)).strip()
+        # Match the broker's poll rate
+        self.interval = float(config.get('interval', broker_config.get('interval', self.interval)))
+        self._client = BrokerClient(socket_path)
+        self._register_types = RegisterTypeEnum
+        self._registers = registers
+
+    def step(self):
+        try:
+            timestamp, values = self._client.read()
+        except OSError as e:
+            print('EPSolar broker unavailable:', e)
+            return
+
+        flat = {'time': int(timestamp)}
+        document = {'time': int(timestamp)}
+        for name, value in values.items():
+            register = self._registers[self._register_types[name]]
+            flat[name] = value
+            document[name] = {
+                'value': value,
+                'name': register.name,
+                'description': register.description,
+                'unit': register.unit(),
+            }
+        self.publish(flat, document)
+
+    def close(self):
+        self._client.close()
+
+class WeatherMonitor(Component):
+    topic = 'weather'
+    interval = 120
+    output = '/tmp/weather.json'
+
+    CITY_ID = 5141508
+
+    # Seconds before trying again after a failed update
+    RETRY = 30
+
+    def __init__(self, name, config, runtime):
+        super(WeatherMonitor, self).__init__(name, config, runtime)
+
+        import pyowm
+        import pyowm.exceptions
+
+        self.sun = runtime.sun()
+        self.city_id = int(config.get('city_id', self.CITY_ID))
+        api_key = config.get('api_key', '').strip()
+        if not api_key:
+            raise ValueError('No api_key in [' + name + ']')
+        self._owm = pyowm.OWM(api_key)
+        self._error = pyowm.exceptions.OWMError
+
+    def step(self):
+        try:
+            observation = self._owm.weather_at_id(self.city_id)
+        except self._error as e:
+            print('Error updating OpenWeatherMap data', e)
+            return self.RETRY
+
+        weather = observation.get_weather()
+
+        now = time.time()
+        document = {
+            'sun': {
+                'elevation': self.sun.elevation(now),
+                # When the fan controllers stop cooling for the day
+                'below_10_at': self.sun.next_crossing(10, now, rising=False),
+            },
+            'weather': {
+                'temperature': weather.get_temperature(unit='celsius'),
+                'pressure': weather.get_pressure(),
+                'humidity': weather.get_humidity(),
+                'wind': weather.get_wind(),
+                'rain': weather.get_rain(),
+                'snow': weather.get_snow(),
+                'clouds': weather.get_clouds(),
+                'dewpoint': weather.get_dewpoint(),
+                'heat_index': weather.get_heat_index(),
+                'status': weather.get_status(),
+                'detailed_status': weather.get_detailed_status(),
+                'weather_code': weather.get_weather_code(),
+                'weather_icon_name': weather.get_weather_icon_name(),
+                'weather_icon_url': weather.get_weather_icon_url(),
+                'visibility_distance': weather.get_visibility_distance(),
+                'time': weather.get_reference_time(),
+            }
+        }
+
+        values = {
+            'time': now,
+            'temperature': document['weather']['temperature'].get('temp'),
+            'humidity': document['weather']['humidity'],
+            'elevation': document['sun']['elevation'],
+        }
+        self.publish(values, document)
+
+class FanControl(Component):
+    '''
+    The PID loop of fan-controller.py, reading the monitors' topics
+    '''
+    def __init__(self, name, config, runtime):
+        super(FanControl, self).__init__(name, config, runtime)
+
+        import board
+        import wiringpi
+
+        from fancontrol import FanControlLoop, EpsolarReader, WeatherReader, TempReader, SAMPLE_TIME
+        from pwmfan import PWMFan
+
+        self.interval = float(config.get('interval', SAMPLE_TIME))
+
+        wiringpi.wiringPiSetupGpio()
+
+        temp_reader = TempReader(source=runtime.source(TempMonitor.topic))
+        weather_reader = WeatherReader(source=runtime.source(WeatherMonitor.topic))
+        epsolar_reader = EpsolarReader(source=runtime.source(EpsolarMonitor.topic))
+
+        self.fan = PWMFan(getattr(board, config.get('fwd_pin', 'D12').strip()), getattr(board, config.get('bwd_pin', 'D16').strip()),
+            int(config.get('pwm_pin', 18)), epsolar_reader)
+        self.fan.actuator.start()
+
+        self.loop = FanControlLoop(self.fan, runtime.sun(), temp_reader, weather_reader, epsolar_reader)
+
+    def step(self):
+        return self.loop.step()
+
+    def close(self):
+        self.fan.actuator.close()
+
+COMPONENTS = {
+    'temp_monitor': TempMonitor,
+    'epsolar_monitor': EpsolarMonitor,
+    'weather_monitor': WeatherMonitor,
+    'fan_controller': FanControl,
+}
+
+class Runtime:
+    def __init__(self, config, names=None, standalone=False):
+        '''
+        Builds the components named (default: [runtime] components). The
+        standalone scripts pass standalone=True, which turns the shared
+        memory and the JSON file outputs on by default.
+        '''
+        self.config = config
+        self.bus = Bus()
+        self._sun = None
+
+        if names is None:
+            names = [name.strip() for name in config['runtime']['components'].split(',')]
+        for name in names:
+            if name not in COMPONENTS:
+                raise ValueError('Unknown component ' + name + ', expected one of ' + ', '.join(COMPONENTS))
+        self._published = set(COMPONENTS[name].topic for name in names)
+
+        self.components = []
+        self._outputs = []
+        for name in names:
+            section = config[name] if name in config else {}
+            component = COMPONENTS[name](name, section, self)
+            self.components.append(component)
+            if component.topic is None:
+                continue
+
+            if _getboolean(section, 'shared_memory', standalone):
+                output = SharedStateOutput(component.topic)
+                self._outputs.append(output)
+                self.bus.subscribe(component.topic, output)
+
+            path = section.get('output', component.output if standalone else '').strip()
+            if path:
+                self.bus.subscribe(component.topic, JsonFileOutput(path))
+
+        self._runners = []
+        self._threads = []
+        # Components whose loop died with an exception
+        self.failed = []
+
+    def sun(self):
+        '''
+        The Ephemeris shared by every component
+        '''
+        if self._sun is None:
+            from ephemeris import Ephemeris
+            self._sun = Ephemeris.from_config(self.config)
+        return self._sun
+
+    def source(self, topic):
+        '''
+        A bus subscription if a component here publishes topic, otherwise
+        None and the reader goes to shared memory
+        '''
+        if topic in self._published:
+            return self.bus.subscribe(topic)
+        return None
+
+    def start(self):
+        for component in self.components:
+            runner = LoopRunner(component.name, component.interval)
+            thread = threading.Thread(target=self._run_component, args=(component, runner), name=component.name, daemon=True)
+            self._runners.append(runner)
+            self._threads.append(thread)
+            thread.start()
+
+    def _run_component(self, component, runner):
+        try:
+            runner.run(component.step)
+        except Exception:
+            print('Component ' + component.name + ' failed:')
+            traceback.print_exc()
+            self.failed.append(component.name)
+            # A loop that's gone (the fan controller's inputs, or the whole
+            # standalone script) is worse than restarting, wake run() up to exit
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGTERM)
+
+    def run(self):
+        '''
+        Run every component until SIGINT or SIGTERM, or until one of them
+        fails, which exits with status 1 so systemd restarts the service
+        '''
+        # Block the stop signals everywhere, the main thread just waits for one
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGINT, signal.SIGTERM])
+        self.start()
+        try:
+            signal.sigwait([signal.SIGINT, signal.SIGTERM])
+        finally:
+            self.close()
+        if self.failed:
+            raise SystemExit('Stopped after ' + ', '.join(self.failed) + ' failed')
+
+    def close(self):
+        for runner in self._runners:
+            runner.stop()
+        # Let the passes in progress finish
+        for thread in self._threads:
+            thread.join(timeout=10)
+        for component in self.components:
+            try:
+                component.close()
+            except Exception as e:
+                print('Error closing ' + component.name + ':', e)
+        for output in self._outputs:
+            output.close()
+
+def _getboolean(section, key, default):
+    value = section.get(key)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'yes', 'true', 'on')
@@ -0,0 +1,160 @@
+import json
+import math
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b'GHSTATE1'
+
+# magic, sequence number, field count, length of the field name block
+HEADER = struct.Struct('<8sQII')
+SEQ_OFFSET = 8
+
+def state_path(name):
+    '''
+    Where the segment for a producer lives
+    '''
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+    return os.path.join(directory, 'greenhouse-' + name + '.state')
+
+class SharedStateWriter:
+    '''
+    Publishes a fixed set of float fields in a shared memory segment.
+
+    The layout (the field names) is written once when the segment is created.
+    Each write is bracketed by a seqlock: the sequence number is odd while the
+    values are being changed and even once they are consistent, so readers
+    never need a lock or a syscall.
+    '''
+    def __init__(self, name, fields):
+        self.fields = list(fields)
+        self._index = {field: i for i, field in enumerate(self.fields)}
+        self.path = state_path(name)
+
+        names = json.dumps(self.fields).encode()
+        names += b' ' * (-len(names) % 8)
+        self._values_offset = HEADER.size + len(names)
+        size = self._values_offset + 8 * len(self.fields)
+
+        # Build the segment next to the old one and swap it in, readers notice the new inode
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, 0, len(self.fields), len(names)))
+            f.write(names)
+            f.write(struct.pack('<%dd' % len(self.fields), *([math.nan] * len(self.fields))))
+        os.replace(tmp_path, self.path)
+
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), size)
+        view = memoryview(self._map)
+        self._seq = view[SEQ_OFFSET:SEQ_OFFSET + 8].cast('Q')
+        self._values = view[self._values_offset:size].cast('d')
+
+    def write(self, values):
+        '''
+        Publish a dict of field -> float, None is stored as NaN. Fields that
+        are left out keep their previous value.
+        '''
+        seq = self._seq[0]
+        self._seq[0] = seq + 1
+        for field in values:
+            value = values[field]
+            self._values[self._index[field]] = math.nan if value is None else value
+        self._seq[0] = seq + 2
+
+    def close(self):
+        self._seq.release()
+        self._values.release()
+        self._map.close()
+        self._file.close()
+
+class SharedStateReader:
+    '''
+    Reads a segment published by a SharedStateWriter.
+
+    update() only copies the values out when the sequence number moved, so
+    polling an idle producer is a couple of memory reads.
+    '''
+    # Check whether the producer replaced its segment after this long without changes
+    REOPEN_AFTER = 10
+
+    def __init__(self, name):
+        self.path = state_path(name)
+        self.fields = []
+        self._index = {}
+        self._map = None
+        self._inode = None
+        self._values = []
+        self._seen = None
+        self._changed = time.monotonic()
+
+    def _open(self):
+        try:
+            with open(self.path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if self._map is not None and stat.st_ino == self._inode:
+                    return True
+                segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        magic, seq, count, names_len = HEADER.unpack_from(segment)
+        if magic != MAGIC:
+            segment.close()
+            return False
+
+        self.close()
+        self._map = segment
+        self._inode = stat.st_ino
+        self.fields = json.loads(segment[HEADER.size:HEADER.size + names_len].decode())
+        self._index = {field: i for i, field in enumerate(self.fields)}
+        view = memoryview(segment)
+        self._seq_view = view[SEQ_OFFSET:SEQ_OFFSET + 8].cast('Q')
+        offset = HEADER.size + names_len
+        self._values_view = view[offset:offset + 8 * count].cast('d')
+        self._values = [math.nan] * count
+        self._seen = None
+        return True
+
+    def update(self):
+        '''
+        Pick up the latest values, returns True if anything changed
+        '''
+        if self._map is None or time.monotonic() - self._changed > self.REOPEN_AFTER:
+            self._changed = time.monotonic()
+            if not self._open():
+                return False
+
+        for attempt in range(10):
+            seq = self._seq_view[0]
+            if seq == self._seen:
+                return False
+            if seq & 1:
+                # Writer is mid-update
+                continue
+
+            values = self._values_view.tolist()
+            if self._seq_view[0] == seq:
+                self._values = values
+                self._seen = seq
+                self._changed = time.monotonic()
+                return True
+
+        return False
+
+    def get(self, field, default=None):
+        index = self._index.get(field)
+        if index is None:
+            return default
+        value = self._values[index]
+        if math.isnan(value):
+            return default
+        return value
+
+    def close(self):
+        if self._map is not None:
+            self._seq_view.release()
+            self._values_view.release()
+            self._map.close()
+            self._map = None
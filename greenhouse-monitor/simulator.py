@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+'''
+Runs the fan control loops against a simulated greenhouse on a virtual clock.
+
+Either fan-controller.py's PID loop (--controller pid) or the monitor's
+FanController handler (--controller handler) is driven through a day or
+more of simulated time, a summer day takes a second or two. The greenhouse
+is a single lumped thermal mass heated by the sun and cooled through its
+walls and the fan:
+
+    C dT/dt = solar gain * sin(elevation) - (UA + fan * speed) * (T - outdoor)
+
+The outdoor temperature is a daily sine between --outdoor-low and
+--outdoor-high, or replayed from a recording with --outdoor. --replay feeds
+a recorded greenhouse temperature to the controller instead of the model,
+to see what it would have decided on a real day.
+
+Recordings are either a CSV file with a `time` column (unix seconds or ISO
+8601) given as `file.csv:column`, or a History handler store given as
+`directory:device.field`. They're in Fahrenheit like everything the monitor
+records, unless --trace-units C.
+
+Both fans ramp through a FanActuator like they do on the Pi, stepped on
+the virtual clock in place of its thread.
+
+The trajectory is written as CSV, one row per --every seconds.
+'''
+import argparse
+import bisect
+import configparser
+import csv
+import datetime
+import math
+import os
+import random
+import sys
+import time
+
+from ephemeris import Ephemeris
+from fanactuator import FanActuator
+from fancontrol import Fan, FanControlLoop, EpsolarReader, WeatherReader, TempReader, TARGET_TEMPERATURE, MAX_INCREASE, MIN_SPEED, SAMPLE_TIME
+from readings import Record, Schema
+
+class VirtualClock:
+    '''
+    Stands in for the time module. sleep() just moves the clock along.
+    '''
+    def __init__(self, start):
+        self._start = start
+        self._now = start
+
+    def time(self):
+        return self._now
+
+    def monotonic(self):
+        return self._now - self._start
+
+    def sleep(self, seconds):
+        if seconds < 0:
+            raise ValueError('sleep length must be non-negative')
+        self._now += seconds
+
+class ThermalModel:
+    '''
+    A single node greenhouse. The defaults are a ~10m2 hobby greenhouse:
+    capacity in J/K (air, soil, benches and water), conductance through the
+    glazing in W/K, solar gain in W with the sun overhead and the fan's
+    conductance in W/K at full speed (~1000m3/h).
+    '''
+    def __init__(self, start, temperature, outdoor, sun, capacity=400e3, conductance=240, solar_gain=6000, fan_conductance=335, step=30):
+        self.time = start
+        self.temperature = temperature
+        self.outdoor = outdoor
+        self.sun = sun
+        self.capacity = capacity
+        self.conductance = conductance
+        self.solar_gain = solar_gain
+        self.fan_conductance = fan_conductance
+        self.step = step
+
+    def advance(self, timestamp, fan_speed):
+        '''
+        Integrate up to timestamp with the fan at fan_speed percent throughout
+        '''
+        while self.time < timestamp:
+            dt = min(self.step, timestamp - self.time)
+            gain = self.solar_gain * max(0.0, math.sin(math.radians(self.sun.elevation(self.time))))
+            loss = (self.conductance + self.fan_conductance * fan_speed / 100.0) * (self.temperature - self.outdoor(self.time))
+            self.temperature += (gain - loss) * dt / self.capacity
+            self.time += dt
+        return self.temperature
+
+class Trace:
+    '''
+    A recorded series, linearly interpolated and held at either end
+    '''
+    def __init__(self, times, values):
+        if not times:
+            raise ValueError('Empty trace')
+        self.times = times
+        self.values = values
+        self.start = times[0]
+        self.end = times[-1]
+
+    @classmethod
+    def load(cls, spec, fahrenheit=True):
+        '''
+        Load a `file.csv:column` or `history-directory:device.field` recording
+        '''
+        path, _, name = spec.rpartition(':')
+        if not path or not name:
+            raise ValueError('Expected file.csv:column or directory:device.field, got ' + spec)
+
+        if os.path.isdir(path):
+            from timeseries import TimeSeriesStore
+            store = TimeSeriesStore(path, readonly=True)
+            series = store.series(name)
+            if series is None:
+                raise ValueError('No series ' + name + ' in ' + path)
+            points = list(series.range())
+            store.close()
+        else:
+            points = []
+            with open(path, newline='') as f:
+                for row in csv.DictReader(f):
+                    if row.get(name) not in (None, ''):
+                        points.append((cls._timestamp(row['time']), float(row[name])))
+            points.sort()
+
+        points = [(t, v) for t, v in points if not math.isnan(v)]
+        if fahrenheit:
+            points = [(t, (v - 32) * 5 / 9.0) for t, v in points]
+        return cls([t for t, v in points], [v for t, v in points])
+
+    @staticmethod
+    def _timestamp(value):
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+    def __call__(self, timestamp):
+        i = bisect.bisect_right(self.times, timestamp)
+        if i == 0:
+            return self.values[0]
+        if i == len(self.times):
+            return self.values[-1]
+        t0, t1 = self.times[i - 1], self.times[i]
+        v0, v1 = self.values[i - 1], self.values[i]
+        return v0 + (v1 - v0) * (timestamp - t0) / (t1 - t0)
+
+def diurnal(low, high, longitude, warmest=15):
+    '''
+    Outdoor temperature swinging between low and high, warmest at the
+    `warmest` hour of local solar time
+    '''
+    def outdoor(timestamp):
+        hour = (timestamp / 3600.0 + longitude / 15.0) % 24
+        return (low + high) / 2.0 + (high - low) / 2.0 * math.cos(2 * math.pi * (hour - warmest) / 24)
+    return outdoor
+
+class SimulatedState:
+    '''
+    Stands in for a SharedStateReader, the simulation sets the values
+    '''
+    def __init__(self):
+        self.values = {}
+
+    def update(self):
+        return True
+
+    def get(self, field, default=None):
+        value = self.values.get(field)
+        return default if value is None else value
+
+# Both fans' PWM range
+PWM_RANGE = 240
+
+class SimulatedFan(Fan):
+    '''
+    pwmfan.PWMFan without the GPIO
+    '''
+    def __init__(self, epsolar_reader, clock):
+        actuator = FanActuator(self, PWM_RANGE, slew_up=MAX_INCREASE / SAMPLE_TIME, min_speed=MIN_SPEED, clock=clock)
+        Fan.__init__(self, epsolar_reader, actuator)
+
+class SimulatedSensor:
+    '''
+    Just enough of a device for the FanController handler to read
+    '''
+    SCHEMA = Schema(['temperature'])
+
+    def __init__(self, device_name):
+        self.device_name = device_name
+        self.reading = Record(self.SCHEMA)
+
+    def set_temperature(self, temperature):
+        self.reading.set(0, temperature)
+
+class SimulatedExhaustFan:
+    '''
+    Just enough of devices.Fan for the FanController handler to drive
+    '''
+    def __init__(self, device_name, clock):
+        self.device_name = device_name
+        self.actuator = FanActuator(self, PWM_RANGE, min_speed=10, clock=clock)
+
+    def fwd(self):
+        pass
+
+    def off(self):
+        pass
+
+    def write_duty(self, speed):
+        pass
+
+    def set_speed(self, speed):
+        if speed < 10:
+            speed = 0
+        self.actuator.set_target(speed)
+
+class Simulation:
+    def __init__(self, args, sun, config):
+        self.args = args
+        self.sun = sun
+        self.random = random.Random(args.seed)
+
+        self.outdoor = Trace.load(args.outdoor, args.trace_units == 'F') if args.outdoor else diurnal(args.outdoor_low, args.outdoor_high, sun.longitude)
+        self.replay = Trace.load(args.replay, args.trace_units == 'F') if args.replay else None
+
+        self.start, self.end = self._period()
+        self.clock = VirtualClock(self.start)
+        self.model = ThermalModel(self.start, self.outdoor(self.start), self.outdoor, sun,
+            capacity=args.capacity, conductance=args.conductance, solar_gain=args.solar_gain, fan_conductance=args.fan_conductance)
+
+        if args.controller == 'pid':
+            self.temp_state = SimulatedState()
+            self.weather_state = SimulatedState()
+            self.epsolar_state = SimulatedState()
+            self._publish_pid(self.start, self.model.temperature)
+            epsolar_reader = EpsolarReader(self.clock, self.epsolar_state)
+            self.fan = SimulatedFan(epsolar_reader, self.clock)
+            self.actuator = self.fan.actuator
+            self.loop = FanControlLoop(self.fan, sun, TempReader(self.clock, self.temp_state), WeatherReader(self.clock, self.weather_state),
+                epsolar_reader, clock=self.clock, log=self._log)
+        else:
+            # Imported here, the handlers pull in the whole web stack
+            from handlers.FanController import FanController
+            self.sensor = SimulatedSensor('air')
+            self.exhaust_fan = SimulatedExhaustFan('exhaust_fan', self.clock)
+            self.actuator = self.exhaust_fan.actuator
+            config['simulated_fan_control'] = {'fan': 'exhaust_fan', 'primary_temp_sensors': 'air'}
+            self.controller = FanController(handler_name='simulated_fan_control', handler_config=config['simulated_fan_control'],
+                devices={'air': self.sensor, 'exhaust_fan': self.exhaust_fan})
+            self.controller.clock = self.clock
+
+    def _period(self):
+        args = self.args
+        if args.date is None and self.replay is not None:
+            return self.replay.start, self.replay.end
+        day = datetime.date.today() if args.date is None else datetime.date.fromisoformat(args.date)
+        start = time.mktime(day.timetuple())
+        return start, start + args.days * 86400
+
+    def _log(self, message):
+        if self.args.verbose:
+            print(message, file=sys.stderr)
+
+    def _measure(self, temperature):
+        if self.args.noise:
+            temperature += self.random.gauss(0, self.args.noise)
+        return temperature
+
+    def _publish_pid(self, now, temperature):
+        '''
+        What temp-monitor.py, weather-monitor.py and epsolar-monitor.py would publish
+        '''
+        elevation = self.sun.elevation(now)
+        self.temp_state.values = {'air.temperature': self._measure(temperature), 'air.time': now}
+        self.weather_state.values = {'temperature': self.outdoor(now), 'time': now}
+        self.epsolar_state.values = {
+            'time': now,
+            'BATTERY_TEMPERATURE': temperature,
+            'BATTERY_SOC': self.args.battery_soc,
+            'CHARGING_EQUIPMENT_INPUT_POWER': self.args.panel_watts * max(0.0, math.sin(math.radians(elevation))),
+            'DISCHARGING_EQUIPMENT_OUTPUT_POWER': 0,
+        }
+
+    def fan_speed(self):
+        '''
+        Where the actuator has the fan, not the speed it was asked for
+        '''
+        return self.actuator.speed
+
+    def wait(self, seconds):
+        '''
+        Move the clock on by seconds, stepping the actuator as its thread
+        would while the fan ramps
+        '''
+        actuator = self.actuator
+        end = self.clock.time() + seconds
+        while actuator.speed != actuator.target and self.clock.time() + actuator.period <= end:
+            actuator.step()
+            self.model.advance(self.clock.time() + actuator.period, actuator.speed)
+            self.clock.sleep(actuator.period)
+        self.clock.sleep(end - self.clock.time())
+
+    def step(self, now):
+        '''
+        Bring the greenhouse up to now, run the controller once and return
+        the seconds until the next run
+        '''
+        temperature = self.model.advance(now, self.fan_speed())
+        if self.replay is not None:
+            temperature = self.replay(now)
+
+        if self.args.controller == 'pid':
+            self._publish_pid(now, temperature)
+            return temperature, self.loop.step()
+
+        self.sensor.set_temperature(self._measure(temperature) * 9 / 5.0 + 32)
+        self.controller.process()
+        return temperature, self.args.interval
+
+    def run(self, writer):
+        summary = Summary()
+        next_row = self.start
+        while self.clock.time() < self.end:
+            now = self.clock.time()
+            temperature, wait = self.step(now)
+            speed = self.fan_speed()
+            summary.add(now, temperature, speed)
+
+            if now >= next_row:
+                if self.args.controller == 'pid':
+                    target = round(self.loop.pid.setpoint, 3)
+                else:
+                    target = self.controller.cooling_state.name
+                writer.writerow([int(now), datetime.datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+                    round(self.outdoor(now), 3), round(temperature, 3), round(self.sun.elevation(now), 3), round(speed, 2), target])
+                next_row = now + self.args.every
+
+            self.wait(wait)
+        summary.finish(self.clock.time())
+        return summary
+
+class Summary:
+    def __init__(self):
+        self.peak = None
+        self.above_target = 0.0
+        self.fan_on = 0.0
+        self.duty = 0.0
+        self.starts = 0
+        self._last = None
+
+    def add(self, now, temperature, speed):
+        if self.peak is None or temperature > self.peak[1]:
+            self.peak = (now, temperature)
+        self._account(now)
+        if speed and (self._last is None or not self._last[2]):
+            self.starts += 1
+        self._last = (now, temperature, speed)
+
+    def _account(self, now):
+        if self._last is None:
+            return
+        last_time, temperature, speed = self._last
+        dt = now - last_time
+        if temperature > TARGET_TEMPERATURE:
+            self.above_target += dt
+        if speed:
+            self.fan_on += dt
+            self.duty += dt * speed / 100.0
+
+    def finish(self, now):
+        self._account(now)
+        self._last = None
+
+    def report(self, out):
+        peak_time, peak = self.peak
+        print('Peak temperature: %.1fC at %s' % (peak, datetime.datetime.fromtimestamp(peak_time).strftime('%H:%M')), file=out)
+        print('Above %.1fC for %.1f hours' % (TARGET_TEMPERATURE, self.above_target / 3600), file=out)
+        print('Fan on for %.1f hours, %d start(s), %.1f full speed hours' % (self.fan_on / 3600, self.starts, self.duty / 3600), file=out)
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate the fan control loops on a virtual clock')
+    parser.add_argument('--controller', choices=('pid', 'handler'), default='pid', help="fan-controller.py's PID loop or the FanController handler (default pid)")
+    parser.add_argument('--config', default='/etc/greenhouse-monitor.conf', help='where to read [location] from')
+    parser.add_argument('--latitude', type=float, help='overrides the configured location')
+    parser.add_argument('--longitude', type=float, help='overrides the configured location')
+    parser.add_argument('--date', help='local day to start on, YYYY-MM-DD (default today, or the replayed trace)')
+    parser.add_argument('--days', type=float, default=1, help='days to simulate (default 1)')
+    parser.add_argument('--interval', type=float, default=10, help='seconds between FanController runs (default 10)')
+    parser.add_argument('--outdoor', help='recorded outdoor temperature, file.csv:column or directory:device.field')
+    parser.add_argument('--outdoor-low', type=float, default=18, help='synthetic outdoor low in C (default 18)')
+    parser.add_argument('--outdoor-high', type=float, default=32, help='synthetic outdoor high in C (default 32)')
+    parser.add_argument('--replay', help='recorded greenhouse temperature to feed the controller instead of the model')
+    parser.add_argument('--trace-units', choices=('F', 'C'), default='F', help='units of the recordings (default F)')
+    parser.add_argument('--noise', type=float, default=0, help='sensor noise standard deviation in C (default 0)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the sensor noise (default 0)')
+    parser.add_argument('--capacity', type=float, default=400e3, help='greenhouse heat capacity in J/K (default 400000)')
+    parser.add_argument('--conductance', type=float, default=240, help='loss through the glazing in W/K (default 240)')
+    parser.add_argument('--solar-gain', type=float, default=6000, help='solar heating with the sun overhead in W (default 6000)')
+    parser.add_argument('--fan-conductance', type=float, default=335, help='fan cooling at full speed in W/K (default 335)')
+    parser.add_argument('--panel-watts', type=float, default=100, help='solar panel output with the sun overhead (default 100)')
+    parser.add_argument('--battery-soc', type=float, default=60, help='battery state of charge (default 60)')
+    parser.add_argument('--every', type=float, default=60, help='seconds between output rows, 0 for every step (default 60)')
+    parser.add_argument('--output', help='write the trajectory here instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help="print the PID loop's log lines to stderr")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    if args.latitude is not None and args.longitude is not None:
+        config['location'] = {'latitude': str(args.latitude), 'longitude': str(args.longitude)}
+    sun = Ephemeris.from_config(config)
+
+    simulation = Simulation(args, sun, config)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(['time', 'local_time', 'outdoor', 'greenhouse', 'elevation', 'fan_speed', 'target'])
+        started = time.monotonic()
+        summary = simulation.run(writer)
+    finally:
+        if args.output:
+            out.close()
+
+    summary.report(sys.stderr)
+    print('Simulated %.1f hours in %.2fs' % ((simulation.end - simulation.start) / 3600, time.monotonic() - started), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import json
+import numbers
+import threading
+
+def flatten(data, prefix=''):
+    '''
+    Flatten nested device data into a dict keyed by dotted path
+    '''
+    values = {}
+    for key in data:
+        value = data[key]
+        if isinstance(value, dict):
+            values.update(flatten(value, prefix + key + '.'))
+        else:
+            values[prefix + key] = value
+    return values
+
+def changed(previous, current, deadband=0):
+    '''
+    Compare two flattened readings, numbers only count as changed when they
+    moved by more than the deadband
+    '''
+    if previous is None or previous.keys() != current.keys():
+        return True
+    for key in current:
+        old = previous[key]
+        new = current[key]
+        if isinstance(new, numbers.Real) and isinstance(old, numbers.Real) and not isinstance(new, bool):
+            if abs(new - old) > deadband:
+                return True
+        elif new != old:
+            return True
+    return False
+
+def delta(previous, current):
+    '''
+    The fields of a flattened reading that are new or differ from previous
+    '''
+    if not previous:
+        return dict(current)
+    return {key: current[key] for key in current if key not in previous or previous[key] != current[key]}
+
+class Snapshot:
+    '''
+    The encoded state of every device for one update cycle.
+
+    Each device is serialized once, the full state is stitched together from
+    those bytes. Snapshots are never modified after they're built, so any
+    number of readers can share one.
+    '''
+    def __init__(self, generation, device_bodies):
+        self.generation = generation
+        self.device_bodies = device_bodies
+
+        parts = [json.dumps(name).encode() + b':' + body for name, body in device_bodies.items()]
+        self.body = b'{' + b','.join(parts) + b'}'
+
+class SnapshotCache:
+    '''
+    Holds the latest Snapshot, taken once per cycle after the devices update.
+    A device is only encoded again once its generation moves on.
+    '''
+    def __init__(self, devices):
+        self.devices = devices
+        self.current = Snapshot(0, {})
+        self._lock = threading.Lock()
+        # Device name -> generation its body in the current snapshot was encoded at
+        self._generations = {}
+
+    def take(self):
+        with self._lock:
+            previous = self.current
+            bodies = {}
+            for device_name in self.devices:
+                device = self.devices[device_name]
+                if device_name in previous.device_bodies and (device.stale or device.generation == self._generations[device_name]):
+                    # Unchanged, or it may still be mid-update, keep what it last published
+                    bodies[device_name] = previous.device_bodies[device_name]
+                else:
+                    # Read first, an update landing while encoding is picked up next time
+                    self._generations[device_name] = device.generation
+                    bodies[device_name] = device.encode()
+                device.body = bodies[device_name]
+
+            self.current = Snapshot(previous.generation + 1, bodies)
+            return self.current
@@ -0,0 +1,183 @@
+'''
+The AM2302 and DS18B20 readers behind temp-monitor.py and the runtime's
+temp_monitor component.
+'''
+import time
+
+import adafruit_dht
+import board
+import digitalio
+
+from w1thermsensor import W1ThermSensor
+import w1thermsensor.errors
+
+from filters import HampelFilter
+from w1bus import get_bus
+
+# Seconds after power on that failed reads are expected and don't reset anything
+STARTUP_GRACE = 10
+
+class TempReader:
+    '''
+    Sensors start reporting as soon as they have a reading, until then they
+    publish nothing and the fan controller falls back to other sources. The
+    filters accept their first few samples unchecked, so no warm-up reads
+    are needed.
+    '''
+    def __init__(self, name):
+        self._temps = HampelFilter(window=10, threshold=3.0, min_deviation=1.0)
+        self._humids = HampelFilter(window=10, threshold=3.0, min_deviation=3.0)
+        self.temp = None
+        self.humidity = None
+        self.time = None
+        self.name = name
+        self.time = 0
+
+        # Set after the first good reading
+        self.ready = False
+        self._powered = time.monotonic()
+
+    def starting(self):
+        return not self.ready and time.monotonic() - self._powered < STARTUP_GRACE
+
+    def update(self):
+        temp, humidity = self._read()
+
+        if temp:
+            if not self.ready:
+                print(self.name + ": Ready")
+                self.ready = True
+            if self._temps.accept(temp):
+                self.temp = temp
+                self.time = time.time()
+            else:
+                print(self.name + ": Invalid temperature reading")
+        elif not self.starting():
+            print("No temp")
+
+        if humidity:
+            if self._humids.accept(humidity):
+                self.humidity = humidity
+                self.time = time.time()
+
+        #print(self.name + ": " + str(temp) + "C " + str(humidity) + "%")
+
+
+class AM2302Reader(TempReader):
+    def __init__(self, name, power_pin, data_pin):
+        self._power = digitalio.DigitalInOut(power_pin)
+        self._power.direction = digitalio.Direction.OUTPUT
+
+        super().__init__(name)
+
+        self._on()
+        self._sensor = adafruit_dht.DHT22(data_pin)
+        self.model = "AM2302"
+
+    def _off(self):
+        self._power.value = False
+
+    def _on(self):
+        self._power.value = True
+
+    def _reset(self):
+        self._off()
+        time.sleep(0.5)
+        self._on()
+        time.sleep(1)
+
+    def _read(self, count=0):
+        if self.starting():
+            # Still powering up, one try per pass and no resets
+            count = 2
+
+        try:
+            self._sensor.measure()
+
+            if not self._sensor.temperature:
+                raise Exception("Empty reading")
+
+            return self._sensor.temperature, self._sensor.humidity
+        except Exception as e:
+            if count < 2:
+                return self._read(count + 1)
+
+            if self.starting():
+                return None, None
+
+            print(e)
+            print("Resetting sensor")
+            self._reset()
+            return None, None
+
+class DS18B20(TempReader):
+    def __init__(self, name, hwid, power_pin):
+        super().__init__(name)
+
+        self.model = "DS18B20"
+        self._power = digitalio.DigitalInOut(power_pin)
+        self._power.direction = digitalio.Direction.OUTPUT
+        self._on()
+        # Found on the first read, the probe may not be listed right after power on
+        self.__sensor = None
+        self.__hwid = hwid
+
+        # All probes share one conversion per loop when the kernel supports it
+        self.__bus = get_bus()
+
+    def _on(self):
+        self._power.value = True
+
+    def _off(self):
+        self._power.value = False
+
+    def _reset(self):
+        self._off()
+        time.sleep(0.5)
+        self._on()
+        time.sleep(1)
+
+    def _read(self, count=0):
+        if self.starting():
+            # Still powering up, one try per pass and no resets
+            count = 2
+
+        try:
+            if self.__bus.bulk:
+                temp = self.__bus.read(self.__hwid)
+            else:
+                if self.__sensor is None:
+                    self.__sensor = W1ThermSensor(W1ThermSensor.THERM_SENSOR_DS18B20, self.__hwid)
+                temp = self.__sensor.get_temperature(W1ThermSensor.DEGREES_C)
+        except (w1thermsensor.errors.SensorNotReadyError, w1thermsensor.errors.NoSensorFoundError, OSError) as e:
+            if not self.starting():
+                print(e)
+            temp = None
+
+        if temp is not None:
+            return temp, None
+
+        if self.starting():
+            return None, None
+
+        if count < 2:
+            return self._read(count + 1)
+
+        print("Resetting 1wire bus")
+        self._reset()
+        return None, None
+
+def from_spec(name, spec):
+    '''
+    A reader from a configuration line, "DS18B20 <hwid> <power pin>" or
+    "AM2302 <power pin> <data pin>" with pins named as on the board
+    module, like D17
+    '''
+    model, *args = spec.split()
+    if model == "DS18B20":
+        hwid, power_pin = args
+        return DS18B20(name, hwid, getattr(board, power_pin))
+    if model == "AM2302":
+        power_pin, data_pin = args
+        return AM2302Reader(name, getattr(board, power_pin), getattr(board, data_pin))
+    raise ValueError("Unknown temperature sensor model " + model + " for " + name)
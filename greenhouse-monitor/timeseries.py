@@ -0,0 +1,157 @@
+import mmap
+import os
+import struct
+
+MAGIC = b'GHTS0001'
+
+# magic, capacity, count (total samples ever appended), padded to 64 bytes
+HEADER = struct.Struct('<8sQQ')
+HEADER_SIZE = 64
+COUNT_OFFSET = 16
+
+class TimeSeries:
+    '''
+    A fixed-size ring of (timestamp, value) float64 pairs in a memory-mapped file.
+
+    The file holds a small header followed by a timestamp column and a value
+    column, each `capacity` doubles long. Appending writes two slots and bumps
+    the counter in place, so it is O(1) and allocates nothing. Other processes
+    can open the same file with readonly=True and see new samples as they land.
+
+    Timestamps only ever go up, range() bisects on them. A sample older than
+    the newest one (the wall clock stepped back) is dropped.
+    '''
+    def __init__(self, path, capacity=None, readonly=False):
+        self.path = path
+
+        if readonly:
+            self._file = open(path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            if not os.path.exists(path):
+                if not capacity:
+                    raise ValueError('A capacity is needed to create ' + path)
+                with open(path, 'wb') as f:
+                    f.write(HEADER.pack(MAGIC, capacity, 0))
+                    f.truncate(HEADER_SIZE + 16 * capacity)
+            self._file = open(path, 'r+b')
+            self._map = mmap.mmap(self._file.fileno(), 0)
+
+        magic, self.capacity, count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(path + ' is not a time series file')
+        if capacity and capacity != self.capacity:
+            print('Time series ' + path + ' has capacity ' + str(self.capacity) + ', ignoring configured ' + str(capacity))
+
+        view = memoryview(self._map)
+        self._count = view[COUNT_OFFSET:COUNT_OFFSET + 8].cast('Q')
+        values_offset = HEADER_SIZE + 8 * self.capacity
+        self._times = view[HEADER_SIZE:values_offset].cast('d')
+        self._values = view[values_offset:values_offset + 8 * self.capacity].cast('d')
+
+    def append(self, timestamp, value):
+        '''
+        Returns False if the sample was dropped for being out of order
+        '''
+        count = self._count[0]
+        if count and timestamp < self._times[(count - 1) % self.capacity]:
+            return False
+        index = count % self.capacity
+        self._times[index] = timestamp
+        self._values[index] = value
+
+        # Publish the sample only once it's fully written
+        self._count[0] = count + 1
+        return True
+
+    def __len__(self):
+        return min(self._count[0], self.capacity)
+
+    def _slot(self, position):
+        '''
+        Map a position (0 is the oldest retained sample) to a ring slot
+        '''
+        count = self._count[0]
+        first = count - min(count, self.capacity)
+        return (first + position) % self.capacity
+
+    def bisect(self, timestamp):
+        '''
+        Position of the first retained sample at or after timestamp
+        '''
+        lo = 0
+        hi = len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._times[self._slot(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start=None, end=None):
+        '''
+        Yield (timestamp, value) for samples with start <= timestamp < end
+        '''
+        position = 0 if start is None else self.bisect(start)
+        stop = len(self) if end is None else self.bisect(end)
+        while position < stop:
+            slot = self._slot(position)
+            yield self._times[slot], self._values[slot]
+            position += 1
+
+    def last(self):
+        if not len(self):
+            return None
+        slot = self._slot(len(self) - 1)
+        return self._times[slot], self._values[slot]
+
+    def close(self):
+        self._count.release()
+        self._times.release()
+        self._values.release()
+        self._map.close()
+        self._file.close()
+
+class TimeSeriesStore:
+    '''
+    A directory of TimeSeries files, one per device.field series
+    '''
+    def __init__(self, path, capacity=None, readonly=False):
+        self.path = path
+        self.capacity = capacity
+        self.readonly = readonly
+        self._series = {}
+
+        if not readonly:
+            os.makedirs(path, exist_ok=True)
+
+    def _filename(self, name):
+        if '/' in name or name.startswith('.'):
+            raise ValueError('Invalid series name ' + name)
+        return os.path.join(self.path, name + '.ts')
+
+    def series(self, name):
+        '''
+        Get a series, creating it if needed. Returns None for a series that
+        doesn't exist when the store is read-only.
+        '''
+        series = self._series.get(name)
+        if series is None:
+            filename = self._filename(name)
+            if self.readonly and not os.path.exists(filename):
+                return None
+            series = TimeSeries(filename, capacity=self.capacity, readonly=self.readonly)
+            self._series[name] = series
+        return series
+
+    def append(self, name, timestamp, value):
+        return self.series(name).append(timestamp, value)
+
+    def names(self):
+        return sorted(filename[:-3] for filename in os.listdir(self.path) if filename.endswith('.ts'))
+
+    def close(self):
+        for series in self._series.values():
+            series.close()
+        self._series = {}